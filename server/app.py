@@ -1,151 +1,401 @@
-import pickle
-import math
-import re
-
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, jsonify, request
 from flask_cors import CORS
+import numpy as np
 import pandas as pd
 
-from common import ModelData, PredictionSummary, jsonify_spaces
+from cache import ResponseCache, dataset_version
+from columnar import ARROW_MIMETYPE, arrow_spaces, negotiate_mimetype
+from common import (
+    EMPTY_ROWS, MAX_ZOOM, PredictionSummary, calc_center, calc_zoom, df_to_interactive_spaces, feature_column,
+    feature_keys, jsonify_spaces, load_tables, stream_spaces,
+)
+from encoding import compress_response
+from knn import KnnTable
+from pyramid import MIMETYPES, TileArchive
+from raster import TileRenderer, encode_png
+from search import SearchIndex
+from serializer import JSONProvider
+from spatial import SpatialIndex
 
 
 PAGE_SIZE = 20
+BBOX_LIMIT = 5000
+RESPONSE_CACHE_BYTES = 128 * 2 ** 20
+DATA_PATHS = ["bundle", "model_data.pkl", "label_to_word.pkl", "gene_names_to_ko.pkl", "knn", "prediction_summary", "tiles.pyramid"]
 
-MODEL_DATA = ModelData()
-LABEL_TO_WORD = pd.DataFrame.from_dict(
-    pd.read_pickle("label_to_word.pkl").keys(),
-)
-LABEL_TO_WORD.columns = ["label"]
+MODEL_DATA, LABEL_TO_WORD, G2KO = load_tables()
 PREDICTION_SUMMARY = PredictionSummary()
+KNN_TABLE = KnnTable(MODEL_DATA)
+SPATIAL_INDEX = SpatialIndex(MODEL_DATA)
+TILE_RENDERER = TileRenderer(MODEL_DATA, SPATIAL_INDEX)
+TILE_ARCHIVE = TileArchive("tiles.pyramid")
+
+# Built on the first search of each column.
+SEARCH_INDEXES = {}
 
-with open("gene_names_to_ko.pkl", "rb") as o:
-    G2KO = pd.DataFrame(pickle.load(o).items(), columns=["name", "ko"])
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_BYTES, dataset_version(DATA_PATHS))
 
 
 # instantiate the app
 app = Flask(__name__)
 app.config.from_object(__name__)
+app.json = JSONProvider(app)
 
 # enable CORS
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 
+@app.after_request
+def compress(response):
+    return compress_response(response, request)
+
+
 @app.route("/<type_>/search")
 def filter_by_space(type_):
     page = int(request.args.get("page"))
     filter_ = request.args.get("filter")
-    result = sorted(set(_filter_by_space(type_, filter_)))
+    items, done = _search_index(type_).page(filter_, page, PAGE_SIZE)
     return jsonify({
-        "items": result[(page - 1) * PAGE_SIZE:page * PAGE_SIZE],
-        "done": len(result) <= page * PAGE_SIZE,
+        "items": items,
+        "done": done,
     })
 
 
 @app.route("/space/get/<path:name>")
+@RESPONSE_CACHE.cached
 def space_get(name):
-    return jsonify_spaces(
-        MODEL_DATA.df[MODEL_DATA.df["KO"].str.match(
-            name, na=False)],
-        MODEL_DATA,
-    )
+    return _spaces_response(MODEL_DATA.df.iloc[MODEL_DATA.indexes["ko"].match(name)])
 
 
 @app.route("/label/get/<path:label>")
+@RESPONSE_CACHE.cached
 def filter_by_label(label):
-    return jsonify_spaces(MODEL_DATA.df[(MODEL_DATA.df["predicted_class"] == label) & (~MODEL_DATA.df["hypothetical"])], MODEL_DATA)
+    return _spaces_response(MODEL_DATA.lookup("label", label))
 
 
 @app.route("/gene_product/get/<path:name>")
+@RESPONSE_CACHE.cached
 def filter_by_gene_product(name):
-    return jsonify_spaces(MODEL_DATA.df[MODEL_DATA.df["gene_product"] == name], MODEL_DATA)
+    return _spaces_response(MODEL_DATA.lookup("gene_product", name))
 
 
 @app.route("/gene/get/<path:name>")
+@RESPONSE_CACHE.cached
 def filter_by_gene(name):
-    df = G2KO.dropna()
-    # pylint: disable=unsubscriptable-object
-    g2ko_spaces = df[df["name"].str.match(name)]
-    spaces = MODEL_DATA.df[MODEL_DATA.df["KO"].isin(g2ko_spaces["ko"])]
-    return jsonify_spaces(spaces, MODEL_DATA)
+    return _spaces_response(MODEL_DATA.df.iloc[_gene_rows(name)])
 
 
 @app.route("/word/get/<path:label>")
+@RESPONSE_CACHE.cached
 def filter_by_word(label):
-    notna_df = MODEL_DATA.df.dropna(subset=["word"])
-    return jsonify_spaces(notna_df[notna_df["word"].str.match(label.replace(",", "|"))], MODEL_DATA)
+    return _spaces_response(MODEL_DATA.df.iloc[MODEL_DATA.indexes["word"].match(label.replace(",", "|"))])
 
 
 @app.route("/plot/scatter/<path:word>")
+@RESPONSE_CACHE.cached
 def plot_scatter(word):
-    word_data = MODEL_DATA.df[MODEL_DATA.df["word"] == word]
-    pred_df = PREDICTION_SUMMARY.to_pred_df(word)
+    result = _scatter(word)
+    if result is None:
+        abort(404)
 
-    my_range = range(1, len(pred_df.index)+1)
-    data = []
-    my_range = list(my_range)
-    for i, value in enumerate(pred_df['score'].values):
-        data.append({
-            "x": my_range[i],
-            "y": math.log(value),
-        })
-
-    return jsonify(
-        {
-            "label": f"Word: {word}, Hypothetical: {word_data['hypothetical'].values[0]}, Significant: {word_data['significant'].values[0]}",
-            "data": data,
-            "ticks": list(pred_df["class"].values),
-        }
-    )
+    return jsonify(result)
 
 
 @app.route("/neighbors/get/<path:word>")
+@RESPONSE_CACHE.cached
 def neighbors(word):
     additional_columns = []
     if request.args.get("with_distance") == "true":
         additional_columns.append("distance")
 
-    top_k_df = pd.read_csv(
-        f'https://storage.googleapis.com/gnlp.bursteinlab.org/knn/{word}.txt',
-        names=["word", "distance"],
-        delimiter=" ",
+    k_neighbors = request.args.get("k")
+    rows, distances = KNN_TABLE.lookup(word, None if k_neighbors is None else int(k_neighbors))
+    df = MODEL_DATA.df.iloc[rows].assign(distance=distances)
+    return _spaces_response(df, additional_columns)
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """Resolves a list of `{type, value, options}` queries in one request.
+
+    The points of every query are serialized in one pass. With `"dedupe": true` they are returned once, in
+    `spaces`, and each result lists the positions of its points in `points` instead. `fields` selects their attributes
+    like the query parameter of the other routes, as a string or a list of keys.
+    """
+    body = request.get_json(silent=True) or {}
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not all(isinstance(query, dict) for query in queries):
+        abort(400, "expected a list of {type, value, options} queries")
+
+    fields = body.get("fields")
+    if isinstance(fields, list) and all(isinstance(key, str) for key in fields):
+        fields = ",".join(fields)
+    if fields is not None and not isinstance(fields, str):
+        abort(400, "fields must be a string or a list of strings")
+    fields = _fields(fields)
+
+    resolved = [_batch_rows(query.get("type"), query.get("value"), query.get("options")) for query in queries]
+    lookups = [result for result in resolved if not isinstance(result, dict)]
+    all_rows = np.unique(np.concatenate([rows for rows, _ in lookups])) if lookups else EMPTY_ROWS
+    features = df_to_interactive_spaces(MODEL_DATA.df.iloc[all_rows], MODEL_DATA, fields=fields)
+    coords = MODEL_DATA.df[["x", "y"]]
+
+    results = []
+    for result in resolved:
+        if isinstance(result, dict):
+            results.append(result)
+            continue
+
+        rows, distances = result
+        points = np.searchsorted(all_rows, rows).tolist()
+        spaces = coords.iloc[rows]
+        result = {"latlng": calc_center(spaces, MODEL_DATA), "zoom": calc_zoom(spaces, MODEL_DATA)}
+        if body.get("dedupe"):
+            result["points"] = points
+            if distances is not None:
+                result["distances"] = distances.tolist()
+        else:
+            result["spaces"] = [features[point] for point in points]
+            if distances is not None:
+                result["spaces"] = [
+                    {**feature, "value": {**feature["value"], "distance": distance}}
+                    for feature, distance in zip(result["spaces"], distances.tolist())
+                ]
+
+        results.append(result)
+
+    if body.get("dedupe"):
+        return jsonify({"spaces": features, "results": results})
+
+    return jsonify({"results": results})
+
+
+@app.route("/spaces/bbox")
+def spaces_bbox():
+    """Returns the points inside a viewport, in the coordinates of `df_coord_to_latlng`, the most informative first.
+    `label` restricts them to the points `/label/get` would return.
+    """
+    bounds = [request.args.get(arg, type=float) for arg in ("min_lat", "min_lng", "max_lat", "max_lng")]
+    if None in bounds or not np.isfinite(bounds).all():
+        abort(400, "min_lat, min_lng, max_lat and max_lng are required finite numbers")
+
+    label = request.args.get("label")
+    rows = SPATIAL_INDEX.within(
+        *bounds,
+        limit=request.args.get("limit", BBOX_LIMIT, type=int),
+        among=None if label is None else MODEL_DATA.indexes["label"].rows(label),
     )
+    return _spaces_response(MODEL_DATA.df.iloc[rows])
+
+
+@app.route("/spaces/nearest")
+def spaces_nearest():
+    """Returns the `k` points closest to a map position, within `radius` if given, with their `distance`."""
+    lat, lng = request.args.get("lat", type=float), request.args.get("lng", type=float)
+    if lat is None or lng is None or not np.isfinite([lat, lng]).all():
+        abort(400, "lat and lng are required finite numbers")
+    radius = request.args.get("radius", type=float)
+    if radius is not None and not np.isfinite(radius):
+        abort(400, "radius must be a finite number")
+
+    rows, distances = SPATIAL_INDEX.nearest(lat, lng, k=request.args.get("k", 1, type=int), radius=radius)
+    return _spaces_response(MODEL_DATA.df.iloc[rows].assign(distance=distances), ["distance"])
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.png")
+@RESPONSE_CACHE.cached
+def tile(z, x, y):
+    """Serves the map tile `plot.py` drew from the tile archive, or renders it like `plot.py` does when there is no
+    archive. `label` restricts it to the points `/label/get` would return, always rendered.
+    """
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+
+    label = request.args.get("label")
+    if label is None and len(TILE_ARCHIVE):
+        data = TILE_ARCHIVE.get(z, x, y, "png")
+        # plot.py draws no png for the tiles whose points it wrote as json, rendering one would draw them twice.
+        if data is None:
+            abort(404)
+
+        return Response(data, mimetype=MIMETYPES["png"])
+
+    image = TILE_RENDERER.render(z, x, y, among=None if label is None else MODEL_DATA.indexes["label"].rows(label))
+    return Response(encode_png(image), mimetype="image/png")
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.<any(json, bin):kind>")
+@RESPONSE_CACHE.cached
+def points_tile(z, x, y, kind):
+    """Serves the points of a tile `plot.py` wrote, as json or in the binary format of `vectortile.py`, from the tile
+    archive."""
+    data = TILE_ARCHIVE.get(z, x, y, kind)
+    if data is None:
+        abort(404)
+
+    return Response(data, mimetype=MIMETYPES[kind])
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.clusters.json")
+@RESPONSE_CACHE.cached
+def clusters_tile(z, x, y):
+    """Serves the clusters `plot.py` summarized a dense tile into from the tile archive."""
+    data = TILE_ARCHIVE.get(z, x, y, "clusters.json")
+    if data is None:
+        abort(404)
+
+    return Response(data, mimetype=MIMETYPES["clusters.json"])
+
+
+@app.route("/tiles/dictionary.json")
+@RESPONSE_CACHE.cached
+def tile_dictionary():
+    """Serves the string dictionary of the binary tiles, as `plot.py` wrote it with them, from the tile archive."""
+    data = TILE_ARCHIVE.dictionary()
+    if data is None:
+        abort(404)
+
+    return Response(data, mimetype=MIMETYPES["json"])
+
+
+@app.route("/features")
+@RESPONSE_CACHE.cached
+def features_by_id():
+    """Returns the points of the model data rows in `ids`, comma separated, with all their attributes, such as those
+    the binary tiles leave out."""
+    try:
+        rows = [int(id_) for id_ in request.args.get("ids", "").split(",") if id_]
+    except ValueError:
+        abort(400, "ids must be comma separated integers")
+    if any(not 0 <= row < len(MODEL_DATA.df) for row in rows):
+        abort(404)
 
-    k_neighbors = len(top_k_df)
-    if request.args.get("k") is not None:
-        k_neighbors = int(request.args.get("k"))
+    return _spaces_response(MODEL_DATA.df.iloc[rows])
 
-    df = pd.merge(top_k_df.nlargest(k_neighbors, "distance"), MODEL_DATA.df, on="word")
-    return jsonify_spaces(df, MODEL_DATA, additional_columns)
 
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(RESPONSE_CACHE.stats())
 
-def _filter_by_space(type_, filter_):
+
+def _spaces_response(spaces, additional_columns: list[str] = None):
+    """Serializes `spaces` in one JSON document, line by line with `?stream=ndjson`, or as Arrow columns when the
+    client prefers them. `?fields=` keeps only some attributes, see `feature_keys`.
+    """
+    fields = _fields(request.args.get("fields"))
+    if request.args.get("stream") == "ndjson":
+        response = stream_spaces(spaces, MODEL_DATA, additional_columns, fields)
+    elif negotiate_mimetype(request) == ARROW_MIMETYPE:
+        response = Response(arrow_spaces(spaces, MODEL_DATA, additional_columns, fields), mimetype=ARROW_MIMETYPE)
+    else:
+        response = jsonify_spaces(spaces, MODEL_DATA, additional_columns, fields)
+
+    # Also for the routes outside the response cache, which adds it too.
+    response.vary.add("Accept")
+    return response
+
+
+def _fields(fields: str) -> list[str]:
+    try:
+        return feature_keys(fields)
+    except ValueError as error:
+        abort(400, str(error))
+
+
+def _gene_rows(name: str) -> np.ndarray:
+    df = G2KO.dropna()
+    # pylint: disable=unsubscriptable-object
+    return MODEL_DATA.indexes["ko"].rows_of(df["ko"][df["name"].str.match(name)].unique().tolist())
+
+
+def _scatter(word: str) -> dict:
+    """Returns the prediction scores of `word`, or None when it has none or is not in the model data."""
+    word_data = MODEL_DATA.lookup("word", word)
+    if word not in PREDICTION_SUMMARY or len(word_data) == 0:
+        return None
+
+    pred_df = PREDICTION_SUMMARY.to_pred_df(word)
+
+    log_scores = np.log(pred_df["score"].to_numpy())
+    data = [{"x": x, "y": y} for x, y in zip(range(1, len(log_scores) + 1), log_scores.tolist())]
+
+    return {
+        "label": f"Word: {word}, Hypothetical: {feature_column(word_data, 'hypothetical', MODEL_DATA)[0]}, Significant: {feature_column(word_data, 'significant', MODEL_DATA)[0]}",
+        "data": data,
+        "ticks": list(pred_df["class"].values),
+    }
+
+
+def _batch_rows(type_, value, options: dict):
+    """Returns the model rows of a batch query and their distances, if any, or the result itself for scatter queries."""
+    if not isinstance(value, str):
+        abort(400, f"query value must be a string, got {value!r}")
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        abort(400, f"query options must be an object, got {options!r}")
+
+    match type_:
+        case "word":
+            return MODEL_DATA.indexes["word"].match(value.replace(",", "|")), None
+        case "ko" | "space":
+            return MODEL_DATA.indexes["ko"].match(value), None
+        case "label" | "gene_product":
+            return MODEL_DATA.indexes[type_].rows(value), None
+        case "gene":
+            return _gene_rows(value), None
+        case "neighbors":
+            k_neighbors = options.get("k")
+            if k_neighbors is not None:
+                try:
+                    k_neighbors = int(str(k_neighbors))
+                except ValueError:
+                    abort(400, f"k must be an integer, got {k_neighbors!r}")
+            rows, distances = KNN_TABLE.lookup(value, k_neighbors)
+            return rows, distances if options.get("with_distance") else None
+        case "scatter":
+            # A word without predictions fails its own query rather than the whole batch.
+            return _scatter(value) or {"error": f"no predictions for {value!r}"}
+        case _:
+            abort(400, f"unknown query type {type_!r}")
+
+
+def warm_up():
+    """Loads everything the routes would load lazily.
+
+    Called by the gunicorn master before forking (see gunicorn.conf.py) so every worker shares one
+    copy instead of building its own.
+    """
+    MODEL_DATA.load()
+    PREDICTION_SUMMARY.load()
+    KNN_TABLE.load()
+    SPATIAL_INDEX.load()
+    TILE_RENDERER.load()
+    TILE_ARCHIVE.load()
+    for type_ in ("gene", "label", "space", "word"):
+        _search_index(type_)
+
+
+def _search_column(type_) -> tuple[str, pd.Series]:
     match type_:
         case "gene":
-            return _search(G2KO, "name", filter_)
+            return "gene", G2KO["name"]
         case "label":
-            return _search(LABEL_TO_WORD, "label", filter_)
-        case "space":
-            return _search(MODEL_DATA.df, "KO", filter_)
+            return "label", LABEL_TO_WORD["label"]
+        case "space" | "ko":
+            return "KO", MODEL_DATA.column("KO")
         case "word" | "neighbors":
-            return _search(MODEL_DATA.df, "word", filter_)
+            return "word", MODEL_DATA.column("word")
         case _:
-            if type_ == "ko":
-                type_ = "KO"
-
-            return _search(MODEL_DATA.df, type_, filter_)
+            return type_, MODEL_DATA.column(type_)
 
 
-def _search(df, column, filter_: str) -> list[str]:
-    notna_column = df[column].dropna()
-    result = notna_column[
-        notna_column.str.contains(
-            filter_.replace(",", "|"),
-            flags=re.IGNORECASE,
-            na=False,
-        )
-    ]
+def _search_index(type_) -> SearchIndex:
+    key, column = _search_column(type_)
+    if key not in SEARCH_INDEXES:
+        SEARCH_INDEXES[key] = SearchIndex(column)
 
-    return list(result)
+    return SEARCH_INDEXES[key]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,788 @@
+"""Micro benchmarks for the serving paths. Run from the directory holding the data files, like `app.py`."""
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from common import ModelData, PredictionSummary, df_to_interactive_spaces, load_tables, row_to_feature
+
+
+def timed(func, repeat: int) -> float:
+    """Returns the best wall time of `func` in milliseconds over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def report(name: str, before: float, after: float):
+    print(f"{name}: {before:.2f}ms -> {after:.2f}ms ({before / max(after, 1e-9):.1f}x)")
+
+
+def bench_spaces(args):
+    model_data = ModelData()
+    df = model_data.df
+    if args.label is not None:
+        df = df[df["predicted_class"] == args.label]
+
+    df = df.assign(distance=np.random.default_rng(0).random(len(df)))
+    columns = ["distance"]
+
+    def rowwise():
+        return df.apply(lambda row: row_to_feature(model_data, row, columns), axis=1).tolist()
+
+    def columnar():
+        return df_to_interactive_spaces(df, model_data, columns)
+
+    if json.dumps(rowwise(), default=list) != json.dumps(columnar(), default=list):
+        raise AssertionError("columnar features differ from row_to_feature")
+
+    print("rows:", len(df), "parity: ok")
+    report("df_to_interactive_spaces", timed(rowwise, args.repeat), timed(columnar, args.repeat))
+
+
+def bench_indexes(args):
+    model_data = ModelData()
+    df = model_data.df
+    label = df["predicted_class"].mode()[0]
+    gene_product = df["gene_product"].mode()[0]
+    word = df["word"].iloc[len(df) // 2]
+    cases = {
+        "/label/get": (
+            lambda: df[(df["predicted_class"] == label) & (~df["hypothetical"])],
+            lambda: model_data.lookup("label", label),
+        ),
+        "/gene_product/get": (
+            lambda: df[df["gene_product"] == gene_product],
+            lambda: model_data.lookup("gene_product", gene_product),
+        ),
+        "/plot/scatter word": (
+            lambda: df[df["word"] == word],
+            lambda: model_data.lookup("word", word),
+        ),
+    }
+    print("rows:", len(df))
+    for name, (mask, index) in cases.items():
+        if not mask().equals(index()):
+            raise AssertionError(f"{name}: index lookup differs from the mask")
+
+        report(name, timed(mask, args.repeat), timed(index, args.repeat))
+
+
+def bench_scatter(args):
+    tracemalloc.start()
+    summary_df = pd.read_pickle("prediction_summary.pkl")
+    pickle_bytes = tracemalloc.get_traced_memory()[0]
+    word = summary_df["word"].iloc[len(summary_df) // 2]
+    prediction_summary = PredictionSummary()
+    prediction_summary.to_pred_df(word)
+    matrix_bytes = tracemalloc.get_traced_memory()[0] - pickle_bytes
+    tracemalloc.stop()
+
+    def pickled():
+        word_data = summary_df[summary_df["word"] == word]
+        pred_df = pd.DataFrame(
+            word_data["prediction_summary"].values[0].items(),
+            columns=["class", "score"],
+        ).sort_values(by="score", ascending=False).reset_index(drop=True)
+        return [math.log(value) for value in pred_df["score"].values]
+
+    def matrix():
+        return np.log(prediction_summary.to_pred_df(word)["score"].to_numpy()).tolist()
+
+    if not np.allclose(pickled(), matrix(), atol=1e-6):
+        raise AssertionError("score matrix differs from the pickled summary")
+
+    print("words:", len(summary_df), f"python heap: pickle {pickle_bytes / 2 ** 20:.1f}MiB, matrix {matrix_bytes / 2 ** 20:.1f}MiB (mmapped)")
+    report("/plot/scatter scores", timed(pickled, args.repeat), timed(matrix, args.repeat))
+
+
+def bench_startup(args):
+    if args.child is not None:
+        start = time.perf_counter()
+        model_data, _, _ = load_tables(args.child)
+        loaded = time.perf_counter()
+        model_data.lookup("label", model_data.column("predicted_class").iloc[0])
+        first = time.perf_counter()
+        # ru_maxrss is in KiB on Linux.
+        print(json.dumps([(loaded - start) * 1000, (first - loaded) * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024]))
+        return
+
+    for name, bundle_path in (("pickle", ""), ("bundle", args.bundle)):
+        output = subprocess.run(
+            [sys.executable, __file__, "startup", "--child", bundle_path],
+            capture_output=True, check=True, text=True,
+        ).stdout
+        load_ms, first_ms, rss_mib = json.loads(output)
+        print(f"{name}: load {load_ms:.1f}ms, first /label/get lookup {first_ms:.1f}ms, max RSS {rss_mib:.1f}MiB")
+
+
+def bench_memory(_):
+    raw = pd.read_pickle("model_data.pkl").memory_usage(index=False, deep=True)
+    model_data, _, _ = load_tables()
+    normalized = model_data.memory_usage()
+    breakdown = pd.DataFrame({"raw": raw, "normalized": normalized, "dtype": model_data.df.dtypes.astype(str)})
+    breakdown.loc["total"] = [raw.sum(), normalized.sum(), ""]
+    breakdown[["raw", "normalized"]] = breakdown[["raw", "normalized"]].astype(float) / 2 ** 20
+    print(breakdown.to_string(float_format="{:.2f}MiB".format))
+
+
+def bench_compression(args):
+    # Imported here since importing the app loads the tables.
+    import app  # pylint: disable=import-outside-toplevel
+    from encoding import ENCODINGS, compress  # pylint: disable=import-outside-toplevel
+
+    label = app.MODEL_DATA.column("predicted_class").mode()[0]
+    path = f"/label/get/{label}"
+    client = app.app.test_client()
+    body = client.get(path, headers={"Accept-Encoding": "identity"}).get_data()
+    print("path:", path, f"identity: {len(body)} bytes")
+    for encoding in ENCODINGS:
+        headers = {"Accept-Encoding": encoding}
+        response = client.get(path, headers=headers)
+        if response.headers.get("Content-Encoding") != encoding:
+            raise AssertionError(f"{encoding} was not negotiated")
+
+        cached = _cpu_ms(lambda headers=headers: client.get(path, headers=headers), args.repeat)
+        dynamic = _cpu_ms(lambda encoding=encoding: compress(body, encoding), args.repeat)
+        best = compress(body, encoding, best=True)
+        print(f"{encoding}: {len(compress(body, encoding))} bytes dynamic, {len(best)} bytes cached ({len(body) / len(best):.1f}x smaller),"
+              f" compress {dynamic:.2f}ms CPU per request, cached hit {cached:.2f}ms CPU per request")
+
+
+def bench_columnar(args):
+    # Imported here since importing the app loads the tables.
+    import app  # pylint: disable=import-outside-toplevel
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    from columnar import arrow_spaces  # pylint: disable=import-outside-toplevel
+    from common import FEATURE_DEFAULTS, jsonify_spaces  # pylint: disable=import-outside-toplevel
+
+    label = app.MODEL_DATA.column("predicted_class").mode()[0]
+    spaces = app.MODEL_DATA.lookup("label", label)
+    with app.app.app_context():
+        body = jsonify_spaces(spaces, app.MODEL_DATA).get_data()
+        json_ms = timed(lambda: jsonify_spaces(spaces, app.MODEL_DATA).get_data(), args.repeat)
+
+    arrow_body = arrow_spaces(spaces, app.MODEL_DATA)
+    arrow_ms = timed(lambda: arrow_spaces(spaces, app.MODEL_DATA), args.repeat)
+
+    features = json.loads(body)["spaces"]
+    columns = pa.ipc.open_stream(arrow_body).read_all().to_pydict()
+    for i, feature in enumerate(features):
+        values = {key: FEATURE_DEFAULTS.get(key) if columns[key][i] is None else _arrow_value(columns[key][i]) for key in feature["value"]}
+        if values != feature["value"] or not np.allclose([columns["x"][i], columns["y"][i]], [feature["x"], feature["y"]], rtol=1e-6):
+            raise AssertionError(f"Arrow columns differ from the JSON features at row {i}")
+
+    print("label:", label, "rows:", len(features), "parity: ok")
+    print(f"bytes: json {len(body)} -> arrow {len(arrow_body)} ({len(body) / len(arrow_body):.1f}x smaller)")
+    report("encode", json_ms, arrow_ms)
+
+
+def _arrow_value(value):
+    """Turns the structs of Arrow lists back into the lists of the JSON features."""
+    if isinstance(value, list):
+        return [list(item.values()) if isinstance(item, dict) else item for item in value]
+
+    return value
+
+
+def bench_json(args):
+    # Imported here since importing the app loads the tables.
+    import simplejson  # pylint: disable=import-outside-toplevel
+    from flask import Flask  # pylint: disable=import-outside-toplevel
+    from flask.json.provider import DefaultJSONProvider  # pylint: disable=import-outside-toplevel
+    import serializer  # pylint: disable=import-outside-toplevel
+
+    model_data = ModelData()
+    label = model_data.column("predicted_class").mode()[0]
+    spaces = model_data.lookup("label", label)
+    api = {"spaces": df_to_interactive_spaces(spaces, model_data), "latlng": {"lat": -1.5, "lng": 2.0}, "zoom": 3}
+    # What `plot_jsons` writes, with NumPy scalars and NaNs left in like a tile of raw columns.
+    tile = {"spaces": df_to_interactive_spaces(spaces, model_data) + [{"x": np.float32(1.5), "y": np.nan, "value": {"count": np.int64(2), "scores": np.array([0.5, np.nan])}}]}
+
+    flask_app = Flask(__name__)
+    cases = {
+        "api": (
+            lambda: DefaultJSONProvider(flask_app).response(api).get_data(),
+            lambda: serializer.JSONProvider(flask_app).response(api).get_data(),
+        ),
+        "tile": (
+            lambda: simplejson.dumps(tile, ignore_nan=True, default=serializer._default).encode("utf8"),  # pylint: disable=protected-access
+            lambda: serializer.dumps(tile),
+        ),
+    }
+    print("label:", label, "points:", len(spaces), "engine:", "orjson" if serializer.orjson is not None else "json")
+    for name, (before, after) in cases.items():
+        if simplejson.loads(before()) != simplejson.loads(after()):
+            raise AssertionError(f"{name}: encoders disagree")
+
+        size = len(after()) / 2 ** 20
+        before_ms, after_ms = timed(before, args.repeat), timed(after, args.repeat)
+        report(name, before_ms, after_ms)
+        print(f"{name}: {size / before_ms * 1000:.0f}MiB/s -> {size / after_ms * 1000:.0f}MiB/s")
+
+
+def bench_batch(args):
+    # Imported here since importing the app loads the tables.
+    import app  # pylint: disable=import-outside-toplevel
+
+    app.warm_up()
+    # Nothing fits, so every request is resolved again.
+    app.RESPONSE_CACHE.max_bytes = 0
+    client = app.app.test_client()
+    words = app.MODEL_DATA.column("word").drop_duplicates().sample(args.queries, random_state=0).tolist()
+    queries = [{"type": "word", "value": word} for word in words] + [{"type": "neighbors", "value": word} for word in words]
+
+    def separate():
+        return [client.get(urllib.parse.quote(f"/{query['type']}/get/{query['value']}")).get_json() for query in queries]
+
+    def batched():
+        return client.post("/batch", json={"queries": queries}).get_json()["results"]
+
+    if separate() != batched():
+        raise AssertionError("batch results differ from the separate requests")
+
+    print("queries:", len(queries), "parity: ok")
+    report("/batch", timed(separate, args.repeat), timed(batched, args.repeat))
+
+
+def bench_bbox(args):
+    from common import TILE_SIZE, df_coord_to_latlng  # pylint: disable=import-outside-toplevel
+    from spatial import SpatialIndex, informative_ranks  # pylint: disable=import-outside-toplevel
+
+    model_data, _, _ = load_tables()
+    index = SpatialIndex(model_data)
+    index.load()
+    lat, lng = df_coord_to_latlng(model_data.column("y").to_numpy(dtype=float), model_data.column("x").to_numpy(dtype=float), model_data)
+    ranks = informative_ranks(model_data)
+    print("rows:", len(lat))
+    for zoom in (0, 2, 4, 6):
+        size = TILE_SIZE / 2 ** zoom
+        boxes = [(-lat_start - size, lng_start, -lat_start, lng_start + size) for lat_start, lng_start in np.random.default_rng(zoom).uniform(0, TILE_SIZE - size, (20, 2))]
+
+        def scan(boxes=boxes):
+            result = []
+            for min_lat, min_lng, max_lat, max_lng in boxes:
+                rows = np.flatnonzero((lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng))
+                result.append(rows[np.argsort(ranks[rows], kind="stable")][:args.limit])
+            return result
+
+        def indexed(boxes=boxes):
+            return [index.within(*box, limit=args.limit) for box in boxes]
+
+        if not all(np.array_equal(expected, found) for expected, found in zip(scan(), indexed())):
+            raise AssertionError(f"zoom {zoom}: grid query differs from the full scan")
+
+        report(f"zoom {zoom} viewport x{len(boxes)}", timed(scan, args.repeat), timed(indexed, args.repeat))
+
+
+def bench_nearest(args):
+    from common import TILE_SIZE, df_coord_to_latlng  # pylint: disable=import-outside-toplevel
+    from spatial import SpatialIndex  # pylint: disable=import-outside-toplevel
+
+    model_data, _, _ = load_tables()
+    index = SpatialIndex(model_data)
+    index.load()
+    lat, lng = df_coord_to_latlng(model_data.column("y").to_numpy(dtype=float), model_data.column("x").to_numpy(dtype=float), model_data)
+    points = np.random.default_rng(0).uniform(0, TILE_SIZE, (100, 2)) * [-1, 1]
+
+    def scan():
+        result = []
+        for point_lat, point_lng in points:
+            distances = np.hypot(lat - point_lat, lng - point_lng)
+            result.append(np.lexsort((np.arange(len(distances)), distances))[:args.k])
+        return result
+
+    def indexed():
+        return [index.nearest(point_lat, point_lng, k=args.k)[0] for point_lat, point_lng in points]
+
+    if not all(np.array_equal(expected, found) for expected, found in zip(scan(), indexed())):
+        raise AssertionError("grid nearest points differ from the full scan")
+
+    scan_ms, indexed_ms = timed(scan, args.repeat), timed(indexed, args.repeat)
+    print("rows:", len(lat), "queries:", len(points), "k:", args.k, f"{indexed_ms * 1000 / len(points):.0f}us per query")
+    report("nearest", scan_ms, indexed_ms)
+
+
+def bench_tiles(args):
+    from raster import TileRenderer, encode_png  # pylint: disable=import-outside-toplevel
+    from spatial import SpatialIndex  # pylint: disable=import-outside-toplevel
+
+    model_data, _, _ = load_tables()
+    renderer = TileRenderer(model_data, SpatialIndex(model_data))
+    renderer.render(0, 0, 0)
+    print("rows:", len(model_data.column("x")))
+    for zoom in range(args.max_zoom + 1):
+        tiles = np.random.default_rng(zoom).integers(0, 2 ** zoom, (min(args.tiles, 4 ** zoom), 2)).tolist()
+        sizes = [len(encode_png(renderer.render(zoom, x, y))) for x, y in tiles]
+        render_ms = timed(lambda tiles=tiles, zoom=zoom: [renderer.render(zoom, x, y) for x, y in tiles], args.repeat) / len(tiles)
+        total_ms = timed(lambda tiles=tiles, zoom=zoom: [encode_png(renderer.render(zoom, x, y)) for x, y in tiles], args.repeat) / len(tiles)
+        print(f"zoom {zoom}: render {render_ms:.1f}ms, with png {total_ms:.1f}ms per tile, {np.mean(sizes) / 1024:.1f}KiB per tile ({len(tiles)} tiles)")
+
+
+def bench_plot_static(args):
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    from plot import Plotter  # pylint: disable=import-outside-toplevel
+
+    plotter = Plotter(1)
+    with tempfile.TemporaryDirectory() as outdir:
+        for zoom in range(args.max_zoom + 1):
+            times = {}
+            for renderer in ("matplotlib", "numpy"):
+                plotter.renderer = renderer
+                os.makedirs(os.path.join(outdir, renderer, str(zoom)))
+                with open(os.devnull, "w", encoding="utf8") as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        start = time.perf_counter()
+                        plotter.plot_static(plotter.model_data.df, os.path.join(outdir, renderer, str(zoom)), zoom)
+                        times[renderer] = (time.perf_counter() - start) * 1000
+                    finally:
+                        sys.stdout = stdout
+
+            names = sorted(os.listdir(os.path.join(outdir, "matplotlib", str(zoom))))
+            if names != sorted(os.listdir(os.path.join(outdir, "numpy", str(zoom)))):
+                raise AssertionError(f"zoom {zoom}: the renderers wrote different tiles")
+
+            # Premultiplied, since fully transparent pixels may hold any color, and over the pixels either renderer
+            # drew, since the tiles are mostly empty.
+            diffs = []
+            for name in names:
+                images = [plt.imread(os.path.join(outdir, renderer, str(zoom), name)) for renderer in ("matplotlib", "numpy")]
+                matplotlib_image, numpy_image = [image[..., :3] * image[..., 3:] for image in images]
+                drawn = matplotlib_image.any(axis=-1) | numpy_image.any(axis=-1)
+                diffs.append(np.abs(matplotlib_image - numpy_image)[drawn] * 255)
+
+            mean_diff, max_diff = np.mean(np.concatenate(diffs)), max(diff.max() for diff in diffs)
+            if mean_diff > args.max_mean_diff:
+                raise AssertionError(f"zoom {zoom}: drawn pixels differ by {mean_diff:.3f}/255 on average")
+
+            print(f"zoom {zoom}: {len(names)} tiles, mean diff {mean_diff:.3f}/255, max diff {max_diff:.0f}/255")
+            report(f"zoom {zoom} plot_static", times["matplotlib"], times["numpy"])
+
+
+def bench_plot_jsons(args):
+    import filecmp  # pylint: disable=import-outside-toplevel
+    from plot import Plotter  # pylint: disable=import-outside-toplevel
+
+    plotter = Plotter(1)
+    with tempfile.TemporaryDirectory() as outdir:
+        for zoom in range(args.max_zoom + 1):
+            times, remaining = {}, {}
+            for name, plot_jsons in (("masks", lambda outdir, zoom: _plot_jsons_by_masks(plotter, outdir, zoom, args.threshold)),
+                                     ("binned", lambda outdir, zoom: plotter.plot_jsons(outdir, zoom, args.threshold))):
+                os.makedirs(os.path.join(outdir, name, str(zoom)))
+                with open(os.devnull, "w", encoding="utf8") as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        start = time.perf_counter()
+                        remaining[name] = plot_jsons(os.path.join(outdir, name, str(zoom)), zoom)
+                        times[name] = (time.perf_counter() - start) * 1000
+                    finally:
+                        sys.stdout = stdout
+
+            masks_dir, binned_dir = (os.path.join(outdir, name, str(zoom)) for name in ("masks", "binned"))
+            names = sorted(os.listdir(masks_dir))
+            if names != sorted(os.listdir(binned_dir)):
+                raise AssertionError(f"zoom {zoom}: different tiles were written")
+            _, mismatch, errors = filecmp.cmpfiles(masks_dir, binned_dir, names, shallow=False)
+            if mismatch or errors:
+                raise AssertionError(f"zoom {zoom}: tiles differ: {(mismatch + errors)[:5]}")
+            if not remaining["masks"].index.equals(remaining["binned"].index):
+                raise AssertionError(f"zoom {zoom}: different points were left for the png tiles")
+
+            print(f"zoom {zoom}: {len(names)} identical tiles, {len(remaining['binned'])} points left")
+            report(f"zoom {zoom} plot_jsons", times["masks"], times["binned"])
+
+
+def bench_build(args):
+    import filecmp  # pylint: disable=import-outside-toplevel
+    import plot  # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as outdir:
+        times, names = {}, {}
+        for workers in (1, args.workers):
+            build_args = argparse.Namespace(
+                outdir=os.path.join(outdir, str(workers)), min_zoom=0, max_zoom=args.max_zoom, max_png_zoom=args.max_png_zoom,
+                bins=1, min_img_points=args.min_img_points, renderer="numpy", workers=workers, force=False, archive=None, tile_format="json", clusters=False,
+                fields=None,
+            )
+            with open(os.devnull, "w", encoding="utf8") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    start = time.perf_counter()
+                    plot.plot_everything(build_args)
+                    times[workers] = (time.perf_counter() - start) * 1000
+                finally:
+                    sys.stdout = stdout
+
+            names[workers] = sorted(
+                os.path.relpath(os.path.join(root, name), build_args.outdir)
+                for root, _, files in os.walk(build_args.outdir) for name in files
+            )
+
+        if names[1] != names[args.workers]:
+            raise AssertionError("the builds wrote different tiles")
+        _, mismatch, errors = filecmp.cmpfiles(os.path.join(outdir, "1"), os.path.join(outdir, str(args.workers)), names[1], shallow=False)
+        if mismatch or errors:
+            raise AssertionError(f"tiles differ: {(mismatch + errors)[:5]}")
+
+        print(f"{len(names[1])} identical tiles, {os.cpu_count()} cores")
+        report(f"build with {args.workers} workers", times[1], times[args.workers])
+
+
+def bench_archive(args):
+    from pyramid import TileArchive, list_tiles, pack, tile_path  # pylint: disable=import-outside-toplevel
+
+    tiles = list_tiles(args.src)
+    with tempfile.TemporaryDirectory() as outdir:
+        path = os.path.join(outdir, "tiles.pyramid")
+        start = time.perf_counter()
+        pack(args.src, path)
+        pack_ms = (time.perf_counter() - start) * 1000
+        files_size = sum(os.path.getsize(os.path.join(args.src, tile_path(*tile))) for tile in tiles)
+        print(f"{len(tiles)} tiles: {files_size / 2 ** 20:.1f}MiB of files -> {os.path.getsize(path) / 2 ** 20:.1f}MiB archive, packed in {pack_ms:.0f}ms")
+
+        archive = TileArchive(path)
+        archive.load()
+        sample = [tiles[i] for i in np.random.default_rng(0).integers(0, len(tiles), args.reads).tolist()]
+
+        def read_files():
+            for tile in sample:
+                with open(os.path.join(args.src, tile_path(*tile)), "rb") as source:
+                    source.read()
+
+        files_ms = timed(read_files, args.repeat)
+        archive_ms = timed(lambda: [archive.get(*tile) for tile in sample], args.repeat)
+        report(f"read {len(sample)} tiles", files_ms, archive_ms)
+
+
+def bench_vector_tiles(args):
+    import gzip  # pylint: disable=import-outside-toplevel
+    from plot import Plotter  # pylint: disable=import-outside-toplevel
+    from vectortile import EXTENT, HEAVY_COLUMNS, decode_tile  # pylint: disable=import-outside-toplevel
+
+    plotter = Plotter(1)
+    dictionary = json.loads(json.dumps(plotter.dictionary.to_json()))
+    dictionary_size = len(gzip.compress(json.dumps(dictionary).encode("utf8")))
+    print(f"dictionary: {dictionary_size / 1024:.1f}KiB gzipped, once per pyramid")
+    with tempfile.TemporaryDirectory() as outdir:
+        for zoom in range(args.max_zoom + 1):
+            sizes = {}
+            for tile_format in ("json", "binary"):
+                plotter.tile_format = tile_format
+                os.makedirs(os.path.join(outdir, tile_format, str(zoom)))
+                with open(os.devnull, "w", encoding="utf8") as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        plotter.plot_jsons(os.path.join(outdir, tile_format, str(zoom)), zoom, args.threshold)
+                    finally:
+                        sys.stdout = stdout
+
+                contents = {}
+                for name in os.listdir(os.path.join(outdir, tile_format, str(zoom))):
+                    with open(os.path.join(outdir, tile_format, str(zoom), name), "rb") as source:
+                        contents[os.path.splitext(name)[0]] = source.read()
+                sizes[tile_format] = contents
+
+            if sizes["json"].keys() != sizes["binary"].keys():
+                raise AssertionError(f"zoom {zoom}: the formats wrote different tiles")
+            for name, data in sizes["binary"].items():
+                _check_vector_tile(json.loads(sizes["json"][name])["spaces"], decode_tile(data, dictionary), 2 ** -zoom * 256 / EXTENT, HEAVY_COLUMNS)
+
+            if not sizes["json"]:
+                print(f"zoom {zoom}: no point tiles")
+                continue
+
+            raw = {tile_format: sum(map(len, contents.values())) for tile_format, contents in sizes.items()}
+            gzipped = {tile_format: sum(len(gzip.compress(data)) for data in contents.values()) for tile_format, contents in sizes.items()}
+            print(
+                f"zoom {zoom}: {len(sizes['json'])} tiles, json {raw['json'] / 1024:.0f}KiB ({gzipped['json'] / 1024:.0f}KiB gzipped)",
+                f"-> binary {raw['binary'] / 1024:.0f}KiB ({gzipped['binary'] / 1024:.0f}KiB gzipped),",
+                f"{raw['json'] / max(raw['binary'], 1):.1f}x ({gzipped['json'] / max(gzipped['binary'], 1):.1f}x gzipped)",
+            )
+
+
+def _check_vector_tile(expected: list[dict], decoded: list[dict], tolerance: float, heavy_columns: list[str]):
+    """Checks a decoded binary tile holds the json tile's features, up to the quantization of coordinates and float32."""
+    if [feature["id"] for feature in expected] != [feature["id"] for feature in decoded]:
+        raise AssertionError("the tiles hold different points")
+    for json_feature, binary_feature in zip(expected, decoded):
+        if abs(json_feature["x"] - binary_feature["x"]) > tolerance or abs(json_feature["y"] - binary_feature["y"]) > tolerance:
+            raise AssertionError(f"{json_feature['id']} moved beyond the quantization step")
+        for key, value in json_feature["value"].items():
+            if key in heavy_columns or key == "name":
+                continue
+            if key == "tax_ratio" and np.isclose(value, binary_feature["value"][key], rtol=1e-6):
+                continue
+            if value != binary_feature["value"][key]:
+                raise AssertionError(f"{json_feature['id']}: {key} is {binary_feature['value'][key]!r} instead of {value!r}")
+
+
+def bench_clusters(args):
+    from clusters import CELLS  # pylint: disable=import-outside-toplevel
+    from plot import Plotter  # pylint: disable=import-outside-toplevel
+    from serializer import dumps  # pylint: disable=import-outside-toplevel
+
+    plotter = Plotter(1, clusters=True)
+    with tempfile.TemporaryDirectory() as outdir:
+        for zoom in range(args.max_zoom + 1):
+            os.makedirs(os.path.join(outdir, str(zoom)))
+            with open(os.devnull, "w", encoding="utf8") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    start = time.perf_counter()
+                    plotter.plot_jsons(os.path.join(outdir, str(zoom)), zoom, args.threshold)
+                    build_ms = (time.perf_counter() - start) * 1000
+                finally:
+                    sys.stdout = stdout
+
+            names = [name for name in os.listdir(os.path.join(outdir, str(zoom))) if name.endswith(".clusters.json")]
+            if not names:
+                print(f"zoom {zoom}: no dense tiles")
+                continue
+
+            points, clusters, cluster_bytes, point_bytes = 0, [], 0, 0
+            for name in names:
+                with open(os.path.join(outdir, str(zoom), name), "rb") as source:
+                    data = source.read()
+                features = json.loads(data)["clusters"]
+                clusters.append(len(features))
+                cluster_bytes += len(data)
+                count = sum(feature["value"]["count"] for feature in features)
+                points += count
+                # What the tile would hold as points, all of them taken for the estimate.
+                point_bytes += count * len(dumps(df_to_interactive_spaces(plotter.model_data.df.sample(min(200, count), random_state=0), plotter.model_data))) / min(200, count)
+
+            if max(clusters) > CELLS ** 2:
+                raise AssertionError(f"zoom {zoom}: a tile has more than {CELLS ** 2} clusters")
+            print(
+                f"zoom {zoom}: {len(names)} dense tiles, {points} points in {sum(clusters)} clusters (at most {max(clusters)} per tile),",
+                f"~{point_bytes / 2 ** 10 / len(names):.0f}KiB of points -> {cluster_bytes / 2 ** 10 / len(names):.1f}KiB of clusters per tile,",
+                f"plot_jsons {build_ms:.0f}ms",
+            )
+
+
+def bench_fields(args):
+    # Imported here since importing the app loads the tables.
+    import app  # pylint: disable=import-outside-toplevel
+    from common import FIELD_PRESETS  # pylint: disable=import-outside-toplevel
+
+    app.warm_up()
+    # Nothing fits, so every request is serialized again.
+    app.RESPONSE_CACHE.max_bytes = 0
+    client = app.app.test_client()
+    label = app.MODEL_DATA.column("predicted_class").mode()[0]
+    path = urllib.parse.quote(f"/label/get/{label}")
+    full = client.get(path).get_data()
+    features = json.loads(full)["spaces"]
+    print("label:", label, "points:", len(features))
+    for preset in ("minimal", args.fields):
+        body = client.get(path, query_string={"fields": preset}).get_data()
+        keys = app.feature_keys(preset)
+        projected = [{**feature, "value": {key: feature["value"][key] for key in keys}} for feature in features]
+        if json.loads(body)["spaces"] != projected:
+            raise AssertionError(f"fields={preset} differs from the full features")
+
+        batched = client.post("/batch", json={"queries": [{"type": "label", "value": label}], "fields": preset}).get_json()
+        if batched["results"][0]["spaces"] != projected:
+            raise AssertionError(f"/batch with fields={preset} differs from the full features")
+
+        print(f"fields={preset}: {len(keys)} of {len(FIELD_PRESETS['full'])} keys, parity: ok,"
+              f" bytes {len(full)} -> {len(body)} ({len(full) / len(body):.1f}x smaller)")
+        report(f"fields={preset}", timed(lambda: client.get(path), args.repeat),
+               timed(lambda preset=preset: client.get(path, query_string={"fields": preset}), args.repeat))
+
+
+def _plot_jsons_by_masks(plotter, outdir: str, zoom: int, threshold: int) -> pd.DataFrame:
+    """The reference `Plotter.plot_jsons`: masks the remaining points with each tile's bounds, in loop order."""
+    from plot import calc_zoom_levels  # pylint: disable=import-outside-toplevel
+    from serializer import dumps  # pylint: disable=import-outside-toplevel
+
+    df = plotter.model_data.df.copy()
+    zoom_levels = calc_zoom_levels(zoom)
+    for i, x_lines in enumerate(zoom_levels):
+        for j, zoom_ranges in enumerate(x_lines):
+            min_x, max_x, min_y, max_y = plotter._focus(*zoom_ranges)  # pylint: disable=protected-access
+            mask = (df["x"] >= min_x) & (df["x"] <= max_x) & (df["y"] >= min_y) & (df["y"] <= max_y)
+            plot_df = df[mask]
+            if (threshold != -1 and len(plot_df) >= threshold) or len(plot_df) == 0:
+                continue
+
+            with open(os.path.join(outdir, f"space_by_label_{i}_{len(x_lines) - 1 - j}.json"), "wb") as dest:
+                dest.write(dumps({"spaces": df_to_interactive_spaces(plot_df, plotter.model_data)}))
+            df = df[~mask]
+
+    return df
+
+
+def _cpu_ms(func, repeat: int) -> float:
+    """Returns the mean process CPU time of `func` in milliseconds over `repeat` runs."""
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+
+    return (time.process_time() - start) / repeat * 1000
+
+
+def unique_rss(pid: int) -> float:
+    """Returns the private (unshared) memory of a process in MiB."""
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf8") as src:
+        fields = dict(line.split(":", 1) for line in src if ":" in line)
+
+    return sum(int(fields[field].split()[0]) for field in ("Private_Clean", "Private_Dirty")) / 1024
+
+
+def bench_workers(args):
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as per_worker_config:
+        per_worker_config.write("preload_app = False\n")
+        per_worker_config.flush()
+        for name, config in (("per worker", per_worker_config.name), ("preload", os.path.join(server_dir, "gunicorn.conf.py"))):
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                port = sock.getsockname()[1]
+
+            with subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", config, "--pythonpath", server_dir,
+                 "-w", str(args.workers), "-b", f"127.0.0.1:{port}", "app:app"],
+                stderr=subprocess.DEVNULL,
+            ) as master:
+                try:
+                    _warm_workers(port, args.requests)
+                    with open(f"/proc/{master.pid}/task/{master.pid}/children", encoding="utf8") as src:
+                        workers = [int(pid) for pid in src.read().split()]
+
+                    sizes = [unique_rss(pid) for pid in workers]
+                    print(f"{name}: {len(sizes)} workers, unique RSS per worker {np.mean(sizes):.1f}MiB (max {max(sizes):.1f}MiB), master {unique_rss(master.pid):.1f}MiB")
+                finally:
+                    master.terminate()
+
+
+def _warm_workers(port: int, requests: int):
+    model_data, _, _ = load_tables()
+    label = model_data.column("predicted_class").mode()[0]
+    word = model_data.column("word").iloc[0]
+    paths = [f"/label/get/{label}", f"/plot/scatter/{word}", f"/neighbors/get/{word}", "/word/search?page=1&filter=a", "/gene/search?page=1&filter=a"]
+    deadline = time.monotonic() + 120
+    for i in range(requests):
+        url = f"http://127.0.0.1:{port}" + urllib.parse.quote(paths[i % len(paths)], safe="/?=&")
+        while True:
+            try:
+                with urllib.request.urlopen(url) as response:
+                    response.read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", default=5, type=int)
+    subparsers = parser.add_subparsers(required=True)
+
+    spaces_parser = subparsers.add_parser("spaces", help="row-wise vs columnar space serialization")
+    spaces_parser.add_argument("--label", default=None, type=str, help="predicted class to serialize, all rows if omitted")
+    spaces_parser.set_defaults(func=bench_spaces)
+
+    indexes_parser = subparsers.add_parser("indexes", help="boolean masks vs group indexes for the exact match routes")
+    indexes_parser.set_defaults(func=bench_indexes)
+
+    scatter_parser = subparsers.add_parser("scatter", help="pickled prediction summary vs score matrix")
+    scatter_parser.set_defaults(func=bench_scatter)
+
+    startup_parser = subparsers.add_parser("startup", help="cold start time and RSS of the pickles vs the bundle")
+    startup_parser.add_argument("--bundle", default="bundle", type=str)
+    startup_parser.add_argument("--child", default=None, type=str, help=argparse.SUPPRESS)
+    startup_parser.set_defaults(func=bench_startup)
+
+    memory_parser = subparsers.add_parser("memory", help="memory per column of the raw pickle vs the normalized frame")
+    memory_parser.set_defaults(func=bench_memory)
+
+    workers_parser = subparsers.add_parser("workers", help="unique RSS of gunicorn workers with and without preloading")
+    workers_parser.add_argument("--workers", default=4, type=int)
+    workers_parser.add_argument("--requests", default=200, type=int, help="requests spread over the workers before measuring")
+    workers_parser.set_defaults(func=bench_workers)
+
+    compression_parser = subparsers.add_parser("compression", help="bytes on the wire and CPU per request of each content encoding")
+    compression_parser.set_defaults(func=bench_compression)
+
+    columnar_parser = subparsers.add_parser("columnar", help="JSON vs Arrow spaces for the largest label")
+    columnar_parser.set_defaults(func=bench_columnar)
+
+    json_parser = subparsers.add_parser("json", help="stdlib and simplejson vs the shared encoder, for responses and tiles")
+    json_parser.set_defaults(func=bench_json)
+
+    batch_parser = subparsers.add_parser("batch", help="separate /word/get and /neighbors/get requests vs one /batch")
+    batch_parser.add_argument("--queries", default=50, type=int, help="words to look up, each with its neighbors")
+    batch_parser.set_defaults(func=bench_batch)
+
+    bbox_parser = subparsers.add_parser("bbox", help="full scans vs the grid index for viewports at several zooms")
+    bbox_parser.add_argument("--limit", default=5000, type=int)
+    bbox_parser.set_defaults(func=bench_bbox)
+
+    nearest_parser = subparsers.add_parser("nearest", help="full scans vs the grid index for nearest points")
+    nearest_parser.add_argument("--k", default=1, type=int)
+    nearest_parser.set_defaults(func=bench_nearest)
+
+    tiles_parser = subparsers.add_parser("tiles", help="time to render a map tile on request, per zoom")
+    tiles_parser.add_argument("--max-zoom", default=6, type=int)
+    tiles_parser.add_argument("--tiles", default=8, type=int, help="random tiles rendered per zoom")
+    tiles_parser.set_defaults(func=bench_tiles)
+
+    plot_static_parser = subparsers.add_parser("plot_static", help="matplotlib vs the rasterizer for the png tiles, with an image diff")
+    plot_static_parser.add_argument("--max-zoom", default=3, type=int)
+    plot_static_parser.add_argument("--max-mean-diff", default=2.0, type=float, help="mean premultiplied difference allowed over the drawn pixels, out of 255")
+    plot_static_parser.set_defaults(func=bench_plot_static)
+
+    plot_jsons_parser = subparsers.add_parser("plot_jsons", help="a mask per tile vs binning once for the json tiles, with a file comparison")
+    plot_jsons_parser.add_argument("--max-zoom", default=6, type=int)
+    plot_jsons_parser.add_argument("--threshold", default=2000, type=int, help="like plot.py --min-img-points, -1 for none")
+    plot_jsons_parser.set_defaults(func=bench_plot_jsons)
+
+    build_parser = subparsers.add_parser("build", help="plot.py with one process vs a pool of workers, with a file comparison")
+    build_parser.add_argument("--workers", default=os.cpu_count(), type=int)
+    build_parser.add_argument("--max-zoom", default=5, type=int)
+    build_parser.add_argument("--max-png-zoom", default=3, type=int)
+    build_parser.add_argument("--min-img-points", default=2000, type=int)
+    build_parser.set_defaults(func=bench_build)
+
+    archive_parser = subparsers.add_parser("archive", help="loose tile files vs one archive, size and read time")
+    archive_parser.add_argument("--src", default="../web/public/map", type=str, help="the --outdir of plot.py")
+    archive_parser.add_argument("--reads", default=2000, type=int)
+    archive_parser.set_defaults(func=bench_archive)
+
+    vector_tiles_parser = subparsers.add_parser("vector_tiles", help="json vs binary point tiles, size per zoom, with a decoding check")
+    vector_tiles_parser.add_argument("--max-zoom", default=6, type=int)
+    vector_tiles_parser.add_argument("--threshold", default=2000, type=int, help="like plot.py --min-img-points, -1 for none")
+    vector_tiles_parser.set_defaults(func=bench_vector_tiles)
+
+    clusters_parser = subparsers.add_parser("clusters", help="points vs clusters for the tiles over the threshold, size per zoom")
+    clusters_parser.add_argument("--max-zoom", default=4, type=int)
+    clusters_parser.add_argument("--threshold", default=2000, type=int, help="like plot.py --min-img-points")
+    clusters_parser.set_defaults(func=bench_clusters)
+
+    fields_parser = subparsers.add_parser("fields", help="full vs projected spaces for the largest label, with a parity check")
+    fields_parser.add_argument("--fields", default="word,color,significant", type=str, help="keys to compare besides the minimal preset")
+    fields_parser.set_defaults(func=bench_fields)
+
+    parsed = parser.parse_args()
+    parsed.func(parsed)
@@ -0,0 +1,95 @@
+"""Packs the raw model outputs into the memory-mapped files the server loads."""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from common import pack_prediction_summary, read_gene_names_to_ko, read_label_to_word
+from knn import read_neighbors
+from pyramid import extract, pack
+from store import save_array, save_strings, save_table
+
+
+def build_knn(args):
+    sources = sorted(filename[:-len(".txt")] for filename in os.listdir(args.src) if filename.endswith(".txt"))
+    word_ids = {word: i for i, word in enumerate(sources)}
+    lists = []
+    for word in sources:
+        top_k_df = read_neighbors(os.path.join(args.src, f"{word}.txt")).iloc[:args.k]
+        neighbor_ids = [word_ids.setdefault(neighbor, len(word_ids)) for neighbor in top_k_df["word"]]
+        lists.append((neighbor_ids, top_k_df["distance"].to_numpy(dtype=np.float32)))
+
+    width = max((len(ids) for ids, _ in lists), default=0)
+    neighbors = np.full((len(sources), width), -1, dtype=np.int32)
+    distances = np.full((len(sources), width), np.nan, dtype=np.float32)
+    counts = np.zeros(len(sources), dtype=np.int32)
+    for i, (ids, values) in enumerate(lists):
+        neighbors[i, :len(ids)] = ids
+        distances[i, :len(ids)] = values
+        counts[i] = len(ids)
+
+    save_strings(args.out, "words", list(word_ids))
+    save_array(args.out, "neighbors", neighbors)
+    save_array(args.out, "distances", distances)
+    save_array(args.out, "counts", counts)
+    print("packed", len(sources), "neighbor lists of up to", width, "into", args.out)
+
+
+def build_predictions(args):
+    words, classes, scores = pack_prediction_summary(pd.read_pickle(args.src))
+    save_strings(args.out, "words", words)
+    save_strings(args.out, "classes", classes)
+    save_array(args.out, "scores", scores)
+    print("packed", scores.shape[0], "words x", scores.shape[1], "classes into", args.out)
+
+
+def build_bundle(args):
+    save_table(os.path.join(args.out, "model_data"), pd.read_pickle(args.model_data))
+    save_table(os.path.join(args.out, "label_to_word"), read_label_to_word(args.label_to_word))
+    save_table(os.path.join(args.out, "gene_names_to_ko"), read_gene_names_to_ko(args.gene_names_to_ko))
+    print("wrote bundle", args.out)
+
+
+def build_tiles(args):
+    print("packed", pack(args.src, args.out), "tiles into", args.out)
+
+
+def extract_tiles(args):
+    print("extracted", extract(args.src, args.out), "tiles into", args.out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    knn_parser = subparsers.add_parser("knn", help="pack per word neighbor files into one table")
+    knn_parser.add_argument("--src", default="knn_src", type=str, help="directory of {word}.txt neighbor files")
+    knn_parser.add_argument("--out", default="knn", type=str)
+    knn_parser.add_argument("--k", default=None, type=int, help="neighbors to keep per word, all if omitted")
+    knn_parser.set_defaults(func=build_knn)
+
+    predictions_parser = subparsers.add_parser("predictions", help="pack the prediction summary into a score matrix")
+    predictions_parser.add_argument("--src", default="prediction_summary.pkl", type=str)
+    predictions_parser.add_argument("--out", default="prediction_summary", type=str)
+    predictions_parser.set_defaults(func=build_predictions)
+
+    bundle_parser = subparsers.add_parser("bundle", help="save the model data, labels and gene names as columnar tables")
+    bundle_parser.add_argument("--model-data", default="model_data.pkl", type=str)
+    bundle_parser.add_argument("--label-to-word", default="label_to_word.pkl", type=str)
+    bundle_parser.add_argument("--gene-names-to-ko", default="gene_names_to_ko.pkl", type=str)
+    bundle_parser.add_argument("--out", default="bundle", type=str)
+    bundle_parser.set_defaults(func=build_bundle)
+
+    tiles_parser = subparsers.add_parser("tiles", help="pack the tile pyramid plot.py wrote into one archive")
+    tiles_parser.add_argument("--src", default="../web/public/map", type=str, help="the --outdir of plot.py")
+    tiles_parser.add_argument("--out", default="tiles.pyramid", type=str)
+    tiles_parser.set_defaults(func=build_tiles)
+
+    extract_tiles_parser = subparsers.add_parser("extract-tiles", help="write the tiles of an archive back as plot.py files")
+    extract_tiles_parser.add_argument("--src", default="tiles.pyramid", type=str)
+    extract_tiles_parser.add_argument("--out", default="../web/public/map", type=str)
+    extract_tiles_parser.set_defaults(func=extract_tiles)
+
+    parsed = parser.parse_args()
+    parsed.func(parsed)
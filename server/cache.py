@@ -0,0 +1,151 @@
+import collections
+import functools
+import hashlib
+import os
+import threading
+import urllib.parse
+
+from flask import Response, make_response, request
+
+from columnar import JSON_MIMETYPE, negotiate_mimetype
+from encoding import compress, compressible, negotiate
+
+
+CachedResponse = collections.namedtuple("CachedResponse", ["body", "mimetype", "encoding"])
+
+
+class ResponseCache:
+    """Bounded, size aware LRU cache of response bodies, keyed by path, normalized query arguments and the
+    negotiated media type.
+
+    The data only changes between deploys, so a response is identified by the dataset version and its
+    key alone. That gives a strong ETag without rendering anything, and a matching `If-None-Match`
+    is answered with `304 Not Modified` straight away.
+
+    Every content encoding a client negotiates is its own entry, compressed once when it is first
+    asked for, so hits are served without compressing again.
+    """
+    def __init__(self, max_bytes: int, version: str):
+        self.max_bytes = max_bytes
+        self.version = version
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    @staticmethod
+    def key(req) -> str:
+        args = sorted(req.args.items(multi=True))
+        mimetype = negotiate_mimetype(req)
+        key = f"{req.path}?{urllib.parse.urlencode(args)}"
+        return key if mimetype == JSON_MIMETYPE else f"{key}#{mimetype}"
+
+    def etag(self, key: str, encoding: str = None) -> str:
+        etag = hashlib.sha1(f"{self.version}\n{key}".encode("utf8")).hexdigest()
+        return etag if encoding is None else f"{etag}-{encoding}"
+
+    def get(self, key: tuple, count: bool = True) -> CachedResponse:
+        with self._lock:
+            entry = self._entries.get(key)
+            if count:
+                self._counters["misses" if entry is None else "hits"] += 1
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        size = _entry_size(key, entry)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._size -= _entry_size(key, self._entries.pop(key))
+
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._size -= _entry_size(evicted_key, evicted)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        """Drops every entry and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._counters.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self._counters["hits"],
+                "misses": self._counters["misses"],
+                "not_modified": self._counters["not_modified"],
+                "evictions": self._counters["evictions"],
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def cached(self, view):
+        """Decorates a view so its successful responses are cached and carry an ETag."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = self.key(request)
+            encoding = negotiate(request)
+            etag = self.etag(key, encoding)
+            if request.if_none_match.contains(etag):
+                with self._lock:
+                    self._counters["not_modified"] += 1
+
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            entry = self.get((key, encoding))
+            if entry is None:
+                # The identity entry saves rendering again when only the encoding differs.
+                entry = None if encoding is None else self.get((key, None), count=False)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+
+                    entry = CachedResponse(response.get_data(), response.mimetype, None)
+                    self.put((key, None), entry)
+
+                if encoding is not None:
+                    if compressible(entry.body, entry.mimetype):
+                        entry = CachedResponse(compress(entry.body, encoding, best=True), entry.mimetype, encoding)
+                    self.put((key, encoding), entry)
+
+            response = Response(entry.body, mimetype=entry.mimetype)
+            if entry.encoding is not None:
+                response.headers["Content-Encoding"] = entry.encoding
+            response.vary.update(["Accept", "Accept-Encoding"])
+            response.set_etag(etag)
+            return response
+
+        return wrapper
+
+
+def dataset_version(paths: list[str]) -> str:
+    """Identifies the data files by their names, sizes and modification times, without reading them.
+    Missing paths are skipped.
+    """
+    digest = hashlib.sha1()
+    for path in filter(os.path.exists, paths):
+        files = [path] if os.path.isfile(path) else sorted(
+            os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+        )
+        for name in files:
+            stat = os.stat(name)
+            digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf8"))
+
+    return digest.hexdigest()[:16]
+
+
+def _entry_size(key: tuple, entry: CachedResponse) -> int:
+    return len(key[0]) + len(entry.body)
@@ -0,0 +1,81 @@
+"""Summaries of the points of dense tiles, for zooms where drawing every point would be too much.
+
+A tile is split into a grid of `CELLS` x `CELLS` cells and every cell holding points becomes one cluster feature, so
+a cluster tile never has more than `CELLS ** 2` features however many points the tile holds.
+"""
+import numpy as np
+import pandas as pd
+
+from common import ModelData, df_coord_to_latlng
+
+CELLS = 16
+# Words listed per cluster, the most informative first (see `spatial.informative_ranks`).
+REPRESENTATIVES = 3
+
+
+def cluster_features(spaces: pd.DataFrame, ranks: np.ndarray, model_data: ModelData, bounds: tuple) -> list[dict]:
+    """Returns the clusters of the points of a tile, with `ranks` the informative rank of each point and `bounds` the
+    tile's min x, max x, min y and max y in model coordinates.
+
+    A cluster has the point count, the centroid in the coordinates of `df_coord_to_latlng`, the most frequent
+    predicted class and color, the count of each class and the most informative words.
+    """
+    if len(spaces) == 0:
+        return []
+
+    min_x, max_x, min_y, max_y = bounds
+    columns = _cell(spaces["x"].to_numpy(dtype=float), min_x, max_x)
+    rows = _cell(spaces["y"].to_numpy(dtype=float), min_y, max_y)
+    cells, inverse, counts = np.unique(rows * CELLS + columns, return_inverse=True, return_counts=True)
+    lat, lng = df_coord_to_latlng(spaces["y"].to_numpy(dtype=float), spaces["x"].to_numpy(dtype=float), model_data)
+    centroid_lat = np.bincount(inverse, lat) / counts
+    centroid_lng = np.bincount(inverse, lng) / counts
+
+    class_codes, classes = pd.factorize(spaces["predicted_class"].astype(object), sort=True)
+    class_counts = _counts_per_cell(inverse, class_codes, len(cells), len(classes))
+    color_codes, colors = pd.factorize(spaces["color"].astype(object), sort=True)
+    color_counts = _counts_per_cell(inverse, color_codes, len(cells), len(colors))
+
+    # Points by cell, the most informative first.
+    order = np.lexsort((ranks, inverse))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    words = spaces["word"].to_numpy(dtype=object)[order]
+
+    classes, colors = classes.tolist(), colors.tolist()
+    return [
+        {
+            "id": f"cluster_{cell}",
+            "x": float(centroid_lng[i]),
+            "y": float(centroid_lat[i]),
+            "value": {
+                "count": int(counts[i]),
+                "predicted_class": _most_frequent(class_counts[i], classes),
+                "color": _most_frequent(color_counts[i], colors),
+                "classes": {class_: int(count) for class_, count in zip(classes, class_counts[i].tolist()) if count},
+                "words": words[starts[i]:starts[i] + min(REPRESENTATIVES, counts[i])].tolist(),
+            },
+        }
+        for i, cell in enumerate(cells.tolist())
+    ]
+
+
+def _cell(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """The grid column (or row) of each value, points on the far edge in the last cell."""
+    if high <= low:
+        return np.zeros(len(values), dtype=np.int64)
+
+    return np.clip(np.floor((values - low) / (high - low) * CELLS), 0, CELLS - 1).astype(np.int64)
+
+
+def _counts_per_cell(inverse: np.ndarray, codes: np.ndarray, cells: int, values: int) -> np.ndarray:
+    """Counts each value in each cell, missing values (code -1) left out."""
+    present = codes >= 0
+    return np.bincount(inverse[present] * values + codes[present], minlength=cells * values).reshape(cells, values)
+
+
+def _most_frequent(counts: np.ndarray, values: list):
+    """The most frequent value, the first in sorted order on ties, or None when all are missing."""
+    if len(values) == 0 or counts.max() == 0:
+        return None
+
+    return values[int(np.argmax(counts))]
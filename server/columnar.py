@@ -0,0 +1,94 @@
+"""Spaces as an Arrow IPC stream of columns, for clients that would rather not parse a JSON object per point."""
+import json
+
+import numpy as np
+import pandas as pd
+
+from common import FEATURE_COLUMNS, FIELD_PRESETS, ModelData, calc_center, calc_zoom, df_coord_to_latlng
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+JSON_MIMETYPE = "application/json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+# The fields of the `[taxon, count]` items of `tax_distribution`, as Arrow structs.
+TAX_DISTRIBUTION_FIELDS = ["name", "count"]
+# JSON comes first so it wins unless Arrow is preferred outright.
+MIMETYPES = [JSON_MIMETYPE, ARROW_MIMETYPE] if pa is not None else [JSON_MIMETYPE]
+
+
+def negotiate_mimetype(req) -> str:
+    return req.accept_mimetypes.best_match(MIMETYPES, default=JSON_MIMETYPE)
+
+
+def spaces_table(spaces: pd.DataFrame, model_data: ModelData, additional_columns: list[str] = None,
+                 fields: list[str] = None) -> "pa.Table":
+    """Builds the columns of the `jsonify_spaces` features, only those of the `fields` keys when given.
+
+    `x`/`y` are float32, categorical columns are dictionary encoded and missing values are nulls in the validity
+    bitmaps, where the JSON falls back to defaults such as -1. `latlng` and `zoom` are in the schema metadata.
+    """
+    y_coords, x_coords = df_coord_to_latlng(
+        spaces["y"].to_numpy(dtype=float),
+        spaces["x"].to_numpy(dtype=float),
+        model_data,
+    )
+    columns = {
+        "x": pa.array(x_coords.astype(np.float32)),
+        "y": pa.array(y_coords.astype(np.float32)),
+    }
+    for key in FIELD_PRESETS["full"] if fields is None else fields:
+        if key == "name":
+            columns[key] = pa.array([f"{x_coord},{y_coord}" for x_coord, y_coord in zip(x_coords.tolist(), y_coords.tolist())], pa.string())
+        else:
+            columns[key] = _arrow_column(spaces, FEATURE_COLUMNS[key], model_data)
+
+    for column in additional_columns or []:
+        columns[column] = _arrow_column(spaces, column, model_data)
+
+    metadata = {
+        "latlng": json.dumps(calc_center(spaces, model_data)),
+        "zoom": json.dumps(calc_zoom(spaces, model_data)),
+    }
+    return pa.table(columns).replace_schema_metadata(metadata)
+
+
+def arrow_spaces(spaces: pd.DataFrame, model_data: ModelData, additional_columns: list[str] = None,
+                 fields: list[str] = None) -> bytes:
+    table = spaces_table(spaces, model_data, additional_columns, fields)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def _arrow_column(spaces: pd.DataFrame, column: str, model_data: ModelData) -> "pa.Array":
+    values = spaces[column]
+    if column == "tax_distribution":
+        return _arrow_lists(model_data.tax_distribution, values.to_numpy(), TAX_DISTRIBUTION_FIELDS)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Only the categories in the result go in the dictionary.
+        values = values.cat.remove_unused_categories()
+
+    return pa.array(values, from_pandas=True)
+
+
+def _arrow_lists(ragged, ids: np.ndarray, names: list[str]) -> "pa.Array":
+    """Gathers the lists `ids` refer to without building a Python list per row. Items made of fields become structs
+    with the field `names`."""
+    offsets, positions, valid = ragged.gather(ids)
+    if ragged.fields is None:
+        items = _arrow_items(ragged.values[positions])
+    else:
+        items = pa.StructArray.from_arrays([_arrow_items(field[positions]) for field in ragged.fields], names=names)
+
+    return pa.LargeListArray.from_arrays(offsets, items, mask=pa.array(~valid))
+
+
+def _arrow_items(values: np.ndarray) -> "pa.Array":
+    # Object items are strings, typed as such even when there are none.
+    return pa.array(values, type=pa.string() if values.dtype == object else None)
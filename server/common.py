@@ -1,25 +1,183 @@
+import bisect
+import itertools
 import math
+import os
+import pickle
+import re
 
-from flask import jsonify
+from flask import Response, current_app, jsonify
 import numpy as np
 import pandas as pd
 
+from search import REGEX_CHARS
+from store import Ragged, Table, load_array, load_strings
+
 
 TILE_SIZE = 512
 MAX_ZOOM = 9
+GREY_HEX = "#808080"
+COLOR_ORDER = [GREY_HEX, "#6a3d9a", "#ffc067", "#ff1493", "#ffd700", "#00ced1", "#ff9933", "#1f78b4", "#fb9a99", "#e6e6fa", "#b2df8a", "#ffff99", "#b15928", "#e31a1c", "#a865c9", "#33a02c"]
+# Points serialized at once by `stream_spaces`.
+STREAM_CHUNK_SIZE = 2000
+
+EMPTY_ROWS = np.empty(0, dtype=np.intp)
+
+CATEGORY_COLUMNS = ["predicted_class", "color", "product", "gene_name", "gene_product"]
+FLAG_COLUMNS = ["significant", "hypothetical"]
+COUNT_COLUMNS = ["word_count"]
+
+
+class GroupIndex:
+    """Maps each value of a column to the positions of the rows holding it, in row order.
+    """
+    def __init__(self, column: pd.Series, mask: pd.Series = None):
+        positions = np.arange(len(column)) if mask is None else np.flatnonzero(mask.to_numpy(dtype=bool, na_value=False))
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes, values = column.cat.codes.to_numpy()[positions], column.cat.categories
+        else:
+            codes, values = pd.factorize(column.to_numpy()[positions])
+
+        # Rows sorted by value code, the stable sort keeping row order within each value.
+        order = np.argsort(codes, kind="stable")
+        self._rows = positions[order]
+        self._bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        self._codes = dict(zip(values.tolist(), range(len(values))))
+        self._sorted = None
+
+    def rows(self, value) -> np.ndarray:
+        code = self._codes.get(value)
+        if code is None:
+            return EMPTY_ROWS
+
+        return self._rows[self._bounds[code]:self._bounds[code + 1]]
+
+    def rows_of(self, values) -> np.ndarray:
+        """Returns the positions of the rows holding any of `values`, in row order."""
+        codes = [self._codes[value] for value in values if value in self._codes]
+        if not codes:
+            return EMPTY_ROWS
+
+        return np.sort(np.concatenate([self._rows[self._bounds[code]:self._bounds[code + 1]] for code in codes]))
+
+    def match(self, pattern: str) -> np.ndarray:
+        """Returns the positions of the rows whose value matches the regex `pattern` like `Series.str.match`, in row
+        order, testing each distinct value once instead of every row.
+        """
+        if self._sorted is None:
+            self._sorted = sorted(value for value in self._codes if isinstance(value, str))
+
+        regex = re.compile(pattern)
+        matches = set()
+        # Only the values starting with a literal prefix of the pattern can match it.
+        for prefix in set(literal_prefixes(pattern)):
+            for value in itertools.takewhile(lambda value, prefix=prefix: value.startswith(prefix), itertools.islice(
+                self._sorted, bisect.bisect_left(self._sorted, prefix), None,
+            )):
+                if regex.match(value):
+                    matches.add(value)
+
+        return self.rows_of(matches)
+
+
+def literal_prefixes(pattern: str) -> list[str]:
+    """Returns a prefix for each top level alternative of the regex `pattern`, such that whatever it matches starts with
+    one of them. Alternatives are only split when there are no groups, classes or escapes to get wrong.
+    """
+    if "|" in pattern and any(char in pattern for char in "()[]\\"):
+        return [""]
+
+    prefixes = []
+    for alternative in pattern.split("|"):
+        end = 0
+        while end < len(alternative) and alternative[end] not in REGEX_CHARS:
+            end += 1
+
+        # A quantifier may repeat the last literal character zero times.
+        if end < len(alternative) and alternative[end] in "?*{":
+            end -= 1
+
+        prefixes.append(alternative[:max(end, 0)])
 
+    return prefixes
 
-class ModelData:
+
+class ModelData:  # pylint: disable=too-many-instance-attributes
     """Manages the model data with preset calculated values.
+
+    `path` is either the pickled frame or its table in a bundle written by `build.py bundle`,
+    whose columns are only decoded once something uses them. Either way the frame goes through
+    `normalize_dtypes`, and its `tax_distribution` column holds ids into `tax_distribution`.
     """
-    def __init__(self):
-        self.df = pd.read_pickle(
-            "model_data.pkl",
-        )
-        self._x_max = self.df.x.max()
-        self._y_max = self.df.y.max()
-        self._x_min = self.df.x.min()
-        self._y_min = self.df.y.min()
+    def __init__(self, path: str = "model_data.pkl"):
+        self._table = None
+        self._df = None
+        self._tax_distribution = None
+        if os.path.isdir(path):
+            self._table = Table(path)
+        else:
+            df = normalize_dtypes(pd.read_pickle(
+                path,
+            ))
+            self._tax_distribution = Ragged.from_lists(df["tax_distribution"].tolist())
+            df["tax_distribution"] = self._tax_distribution.ids
+            self._df = df
+
+        self._indexes = None
+        self._x_max = self.column("x").max()
+        self._y_max = self.column("y").max()
+        self._x_min = self.column("x").min()
+        self._y_min = self.column("y").min()
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = normalize_dtypes(self._table.to_frame())
+
+        return self._df
+
+    @property
+    def tax_distribution(self) -> Ragged:
+        if self._tax_distribution is None:
+            self._tax_distribution = self._table.ragged("tax_distribution")
+
+        return self._tax_distribution
+
+    def column(self, name: str) -> pd.Series:
+        """Returns a single column without decoding the rest of a bundled frame."""
+        if self._df is None:
+            return self._table.column(name)
+
+        return self._df[name]
+
+    @property
+    def indexes(self):
+        # Row positions for the exact match routes, valid as long as `df` keeps its row order.
+        if self._indexes is None:
+            self._indexes = {
+                "label": GroupIndex(self.column("predicted_class"), ~self.column("hypothetical")),
+                "gene_product": GroupIndex(self.column("gene_product")),
+                "word": GroupIndex(self.column("word")),
+                "ko": GroupIndex(self.column("KO")),
+            }
+
+        return self._indexes
+
+    def lookup(self, index: str, value) -> pd.DataFrame:
+        return self.df.iloc[self.indexes[index].rows(value)]
+
+    def load(self):
+        """Decodes the frame and builds the indexes now instead of on first use."""
+        self._df = self.df
+        self._tax_distribution = self.tax_distribution
+        self._indexes = self.indexes
+
+    def memory_usage(self) -> pd.Series:
+        """Returns the bytes held by each column, including the strings of object columns and the
+        packed lists behind `tax_distribution`.
+        """
+        usage = self.df.memory_usage(index=False, deep=True)
+        usage["tax_distribution"] += self.tax_distribution.nbytes
+        return usage
 
     @property
     def x_max(self):
@@ -39,29 +197,109 @@ class ModelData:
 
 
 class PredictionSummary:
-    """Manages the prediction summary data."""
-    def __init__(self):
-        self._df = None
+    """Manages the prediction summary data, packed by `build.py predictions` into a
+    words x classes score matrix. Classes a word has no score for hold NaN.
+
+    Without the packed directory, such as before `build.py predictions` ran, the matrix is built
+    from `pickle_path` in memory.
+    """
+    def __init__(self, path: str = "prediction_summary", pickle_path: str = "prediction_summary.pkl"):
+        self._path = path
+        self._pickle_path = pickle_path
+        self._scores = None
+        self._classes = None
+        self._word_rows = None
 
     @property
-    def df(self):
-        if self._df is None:
-            self._df = pd.read_pickle(
-                "prediction_summary.pkl",
-            )
+    def scores(self):
+        self.load()
+        return self._scores
 
-        return self._df
+    def load(self):
+        if self._scores is not None:
+            return
+
+        if os.path.isdir(self._path):
+            words, classes = load_strings(self._path, "words"), load_strings(self._path, "classes")
+            self._scores = load_array(self._path, "scores")
+        else:
+            words, classes, self._scores = pack_prediction_summary(pd.read_pickle(self._pickle_path))
+
+        self._classes = np.array(classes, dtype=object)
+        self._word_rows = {}
+        for i, word in enumerate(words):
+            self._word_rows.setdefault(word, i)
+
+    def __contains__(self, word) -> bool:
+        self.load()
+        return word in self._word_rows
 
     def to_pred_df(self, word):
-        word_data = self.df[self.df["word"] == word]
-        pred_df = pd.DataFrame(
-            word_data["prediction_summary"].values[0].items(),
-            columns=["class", "score"],
-        ).sort_values(
-            by="score",
-            ascending=False,
-        ).reset_index(drop=True)
-        return pred_df
+        scores = self.scores[self._word_rows[word]]
+        # NaN sorts last, so the scored classes are the head of the order.
+        order = np.argsort(-scores, kind="stable")[:np.count_nonzero(~np.isnan(scores))]
+        return pd.DataFrame({
+            "class": self._classes[order],
+            "score": scores[order].astype(float),
+        })
+
+
+def pack_prediction_summary(summary_df: pd.DataFrame) -> tuple[list[str], list[str], np.ndarray]:
+    """Returns the words, the classes and the words x classes float32 score matrix of the prediction summary."""
+    class_ids = {}
+    for summary in summary_df["prediction_summary"]:
+        for class_ in summary:
+            class_ids.setdefault(class_, len(class_ids))
+
+    scores = np.full((len(summary_df), len(class_ids)), np.nan, dtype=np.float32)
+    for i, summary in enumerate(summary_df["prediction_summary"]):
+        scores[i, [class_ids[class_] for class_ in summary]] = list(summary.values())
+
+    return summary_df["word"].tolist(), list(class_ids), scores
+
+
+def normalize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the low cardinality string columns to categoricals, and the flags and counts to nullable
+    boolean and integer types.
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+
+    for column in FLAG_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("boolean")
+
+    for column in COUNT_COLUMNS:
+        if column in df and df[column].dropna().mod(1).eq(0).all():
+            df[column] = df[column].astype("Int64")
+
+    return df
+
+
+def read_label_to_word(path: str = "label_to_word.pkl") -> pd.DataFrame:
+    label_to_word = pd.DataFrame.from_dict(
+        pd.read_pickle(path).keys(),
+    )
+    label_to_word.columns = ["label"]
+    return label_to_word
+
+
+def read_gene_names_to_ko(path: str = "gene_names_to_ko.pkl") -> pd.DataFrame:
+    with open(path, "rb") as source:
+        return pd.DataFrame(pickle.load(source).items(), columns=["name", "ko"])
+
+
+def load_tables(bundle_path: str = "bundle") -> tuple[ModelData, pd.DataFrame, pd.DataFrame]:
+    """Loads the model data, labels and gene names from the bundle, or from the pickles if there is none."""
+    if not os.path.isdir(bundle_path):
+        return ModelData(), read_label_to_word(), read_gene_names_to_ko()
+
+    return (
+        ModelData(os.path.join(bundle_path, "model_data")),
+        Table(os.path.join(bundle_path, "label_to_word")).to_frame(),
+        Table(os.path.join(bundle_path, "gene_names_to_ko")).to_frame(),
+    )
 
 
 class Point:
@@ -86,19 +324,103 @@ class Point:
         }
 
 
-def df_to_interactive_spaces(df, model_data: ModelData, additonal_columns: list[str] = None):
-    features = []
-    if df is None:
-        return features
+FEATURE_COLUMNS = {
+    "word": "word",
+    "ko": "KO",
+    "product": "product",
+    "gene_name": "gene_name",
+    "significant": "significant",
+    "ncbi_nr": "ncbi_nr",
+    "predicted_class": "predicted_class",
+    # hex color
+    "color": "color",
+    "hypothetical": "hypothetical",
+    "word_count": "word_count",
+    "tax_distribution": "tax_distribution",
+    "tax_ratio": "tax_ratio",
+}
+FEATURE_DEFAULTS = {
+    "word_count": -1,
+    "tax_ratio": -1,
+}
+# Values of `fields=`: what the map needs to highlight points, and every attribute, for the info panel.
+FIELD_PRESETS = {
+    "minimal": ["word", "predicted_class", "color"],
+    "full": ["name", *FEATURE_COLUMNS],
+}
+
+
+def feature_keys(fields: str = None) -> list[str]:
+    """Returns the feature keys `fields` asks for, a preset name or comma separated keys, in the order of the full
+    preset. Raises ValueError on unknown keys.
+    """
+    if fields is None:
+        return FIELD_PRESETS["full"]
+    if fields in FIELD_PRESETS:
+        return FIELD_PRESETS[fields]
+
+    keys = {key for key in fields.split(",") if key}
+    unknown = sorted(keys.difference(FIELD_PRESETS["full"]))
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
 
-    result = df.apply(
-        lambda row: row_to_feature(model_data, row, additonal_columns),
-        axis=1,
+    return [key for key in FIELD_PRESETS["full"] if key in keys]
+
+
+def df_to_interactive_spaces(df, model_data: ModelData, additonal_columns: list[str] = None, fields: list[str] = None):
+    """Serializes `df` column by column into the same features `row_to_feature` builds per row.
+
+    Only the `fields` keys (see `feature_keys`), all by default, are read and put in the features.
+    """
+    if df is None or len(df) == 0:
+        return []
+
+    y_coords, x_coords = df_coord_to_latlng(
+        df["y"].to_numpy(dtype=float),
+        df["x"].to_numpy(dtype=float),
+        model_data,
     )
-    return result.tolist()
+    x_coords = x_coords.tolist()
+    y_coords = y_coords.tolist()
+    words = df["word"].tolist()
+    columns = {}
+    for key in FIELD_PRESETS["full"] if fields is None else fields:
+        if key == "name":
+            columns[key] = [f"{x_coord},{y_coord}" for x_coord, y_coord in zip(x_coords, y_coords)]
+        elif key == "word":
+            columns[key] = words
+        else:
+            columns[key] = feature_column(df, FEATURE_COLUMNS[key], model_data, FEATURE_DEFAULTS.get(key))
+
+    for column in additonal_columns or []:
+        columns[column] = df[column].tolist()
+
+    keys = list(columns)
+    rows = zip(*columns.values()) if columns else [()] * len(df)
+    return [
+        {
+            "id": word,
+            "x": x_coord,
+            "y": y_coord,
+            "value": dict(zip(keys, values)),
+        }
+        for word, x_coord, y_coord, values in zip(words, x_coords, y_coords, rows)
+    ]
+
+
+def feature_column(df, column, model_data: ModelData, default=None) -> list:
+    if column == "tax_distribution":
+        return model_data.tax_distribution.take(df[column].to_numpy())
+
+    values = df[column].to_numpy(dtype=object, copy=True)
+    if column != "word":
+        values[pd.isnull(values)] = default
+
+    return values.tolist()
 
 
 def row_to_feature(model_data: ModelData, row, additonal_columns: list[str] = None):
+    """Serializes a single row, kept as the reference for `df_to_interactive_spaces`."""
     y_coord, x_coord = df_coord_to_latlng(
         row.y,
         row.x,
@@ -117,7 +439,7 @@ def row_to_feature(model_data: ModelData, row, additonal_columns: list[str] = No
         "color": row.color if not pd.isnull(row.color) else None,
         "hypothetical": row.hypothetical if not pd.isnull(row.hypothetical) else None,
         "word_count": row.word_count if not pd.isnull(row.word_count) else -1,
-        "tax_distribution": row.tax_distribution if not isinstance(pd.isnull(row.tax_distribution), bool) else None,
+        "tax_distribution": model_data.tax_distribution.take(np.array([row.tax_distribution]))[0],
         "tax_ratio": row.tax_ratio if not pd.isnull(row.tax_ratio) else -1,
     }
 
@@ -175,11 +497,28 @@ def calc_center(spaces, model_data: ModelData):
     return {"lat": None if pd.isnull(lat) else lat, "lng": None if pd.isnull(lng) else lng}
 
 
-def jsonify_spaces(spaces, model_data: ModelData, additional_columns: list[str] = None):
+def jsonify_spaces(spaces, model_data: ModelData, additional_columns: list[str] = None, fields: list[str] = None):
     return jsonify(
         {
-            "spaces": df_to_interactive_spaces(spaces, model_data, additional_columns),
+            "spaces": df_to_interactive_spaces(spaces, model_data, additional_columns, fields),
             "latlng": calc_center(spaces, model_data),
             "zoom": calc_zoom(spaces, model_data),
         },
     )
+
+
+def stream_spaces(spaces, model_data: ModelData, additional_columns: list[str] = None, fields: list[str] = None):
+    """Streams the response of `jsonify_spaces` as newline delimited JSON, serializing `STREAM_CHUNK_SIZE` points at a
+    time so memory stays bounded however many points match.
+
+    The first line holds `latlng` and `zoom`, which only need the column extremes, and each following line is a point.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield dumps({"latlng": calc_center(spaces, model_data), "zoom": calc_zoom(spaces, model_data)}) + "\n"
+        for start in range(0, len(spaces), STREAM_CHUNK_SIZE):
+            chunk = df_to_interactive_spaces(spaces.iloc[start:start + STREAM_CHUNK_SIZE], model_data, additional_columns, fields)
+            yield "".join(dumps(space) + "\n" for space in chunk)
+
+    return Response(generate(), mimetype="application/x-ndjson")
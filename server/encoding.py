@@ -0,0 +1,58 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Smaller bodies are not worth the encoding overhead.
+MIN_SIZE = 1024
+# Already compressed formats.
+INCOMPRESSIBLE_PREFIXES = ("image/",)
+# Cached bodies are compressed once, so they can afford the slower, denser levels.
+LEVELS = {
+    "br": {False: 5, True: 9},
+    "gzip": {False: 6, True: 9},
+}
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate(req) -> str:
+    """Returns the preferred content encoding the client accepts, or None for the identity."""
+    return req.accept_encodings.best_match(ENCODINGS)
+
+
+def compressible(body: bytes, mimetype: str) -> bool:
+    return len(body) >= MIN_SIZE and not (mimetype or "").startswith(INCOMPRESSIBLE_PREFIXES)
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    level = LEVELS[encoding][best]
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_response(response, req):
+    """Encodes a finished response body according to `Accept-Encoding`, unless it is already encoded,
+    streamed, too small to bother or already compressed.
+    """
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    encoding = negotiate(req)
+    body = response.get_data()
+    if encoding is None or not compressible(body, response.mimetype):
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
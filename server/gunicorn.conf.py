@@ -0,0 +1,20 @@
+"""Gunicorn settings. The app is loaded and warmed up once in the master, and the forked workers share
+its tables copy-on-write instead of each loading their own copy.
+
+Only the memory-mapped arrays stay shared whatever the workers do. The string columns and the indexes are
+Python objects: a worker copies a page of them as soon as it changes the reference count of an object on
+it, such as the strings of every row it serializes.
+"""
+import gc
+
+
+preload_app = True  # pylint: disable=invalid-name
+
+
+def when_ready(server):  # pylint: disable=unused-argument
+    from app import warm_up  # pylint: disable=import-outside-toplevel
+
+    warm_up()
+    # Moves everything loaded so far out of the collector's reach, so collections in the workers do not
+    # write to (and copy) the shared pages.
+    gc.freeze()
@@ -0,0 +1,105 @@
+import os
+import urllib.error
+
+import numpy as np
+import pandas as pd
+
+from store import load_array, load_strings
+
+# The per word neighbor files `build.py knn` packs.
+KNN_URL = "https://storage.googleapis.com/gnlp.bursteinlab.org/knn/{word}.txt"
+
+
+class KnnTable:  # pylint: disable=too-many-instance-attributes
+    """Top neighbors of every word, packed by `build.py knn` into memory-mapped arrays.
+
+    Row `i` of `neighbors`/`distances` holds the neighbors of `words[i]`, sorted by descending
+    distance and padded with -1/NaN up to the widest list.
+
+    Without the packed directory, such as before `build.py knn` ran, `lookup` reads the neighbor
+    file of the word from `url` instead.
+    """
+    def __init__(self, model_data, path: str = "knn", url: str = KNN_URL):
+        self._model_data = model_data
+        self._path = path
+        self._url = url
+        self._model_words = None
+        self._word_ids = None
+        self._model_rows = None
+        self._neighbors = None
+        self._distances = None
+        self._counts = None
+
+    def load(self):
+        """Loads the table and joins it with the model data, once."""
+        if self._model_words is not None:
+            return
+
+        # A neighbor joins the first model row holding its word.
+        model_words = self._model_data.column("word")
+        unique = ~model_words.duplicated().to_numpy()
+        self._model_words = (pd.Index(model_words[unique]), np.flatnonzero(unique))
+        if not os.path.isdir(self._path):
+            return
+
+        words = load_strings(self._path, "words")
+        self._word_ids = {word: i for i, word in enumerate(words)}
+        self._neighbors = load_array(self._path, "neighbors")
+        self._distances = load_array(self._path, "distances")
+        self._counts = load_array(self._path, "counts")
+        self._model_rows = self._rows_of(words)
+
+    def lookup(self, word: str, k: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the model rows of the top `k` neighbors of `word` and their distances.
+
+        Neighbors missing from the model data are dropped after taking the top `k`, like the
+        inner merge this replaces.
+        """
+        self.load()
+        if self._counts is None:
+            return self._read(word, k)
+
+        id_ = self._word_ids.get(word)
+        if id_ is None or id_ >= len(self._counts):
+            return np.empty(0, dtype=int), np.empty(0)
+
+        count = int(self._counts[id_]) if k is None else min(max(k, 0), int(self._counts[id_]))
+        rows = self._model_rows[self._neighbors[id_, :count]]
+        # Widen through the shortest float32 repr so distances read as they were written.
+        distances = np.array([float(str(distance)) for distance in self._distances[id_, :count]])
+        found = rows >= 0
+        return rows[found], distances[found]
+
+    def _read(self, word: str, k: int = None) -> tuple[np.ndarray, np.ndarray]:
+        try:
+            top_k_df = read_neighbors(self._url.format(word=word))
+        except urllib.error.HTTPError as error:
+            if error.code != 404:
+                raise
+            return np.empty(0, dtype=int), np.empty(0)
+
+        top_k_df = top_k_df.iloc[:None if k is None else max(k, 0)]
+        rows = self._rows_of(top_k_df["word"].to_numpy())
+        found = rows >= 0
+        return rows[found], top_k_df["distance"].to_numpy(dtype=float)[found]
+
+    def _rows_of(self, words) -> np.ndarray:
+        index, rows = self._model_words
+        positions = index.get_indexer(words)
+        return np.where(positions >= 0, rows[positions], -1)
+
+
+def read_neighbors(source: str) -> pd.DataFrame:
+    """Reads a `{word}.txt` neighbor file, from a path or a URL, sorted by descending distance.
+
+    Stable, so ties keep their file order like `nlargest`.
+    """
+    top_k_df = pd.read_csv(
+        source,
+        names=["word", "distance"],
+        delimiter=" ",
+        dtype={"word": str},
+        keep_default_na=False,
+    )
+    order = np.argsort(-top_k_df["distance"].to_numpy(dtype=float), kind="stable")
+    return top_k_df.iloc[order].reset_index(drop=True)
@@ -1,15 +1,31 @@
 import argparse
+import collections
+import hashlib
+import json
+import multiprocessing
 import os
-import simplejson
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
-from common import ModelData, TILE_SIZE, df_to_interactive_spaces
+from clusters import CELLS, REPRESENTATIVES, cluster_features
+from common import (
+    COLOR_ORDER, FEATURE_COLUMNS, FIELD_PRESETS, GREY_HEX, ModelData, TILE_SIZE, df_to_interactive_spaces, feature_keys,
+)
+from pyramid import DICTIONARY_NAME, pack
+from raster import color_groups, encode_png, splat
+from serializer import dumps
+from spatial import informative_ranks
+from store import Ragged
+from vectortile import TileDictionary, encode_tile
 
-GREY_HEX = "#808080"
 GREY_OPACITY = int(0.3 * 255)
-COLOR_ORDER = [GREY_HEX, "#6a3d9a", "#ffc067", "#ff1493", "#ffd700", "#00ced1", "#ff9933", "#1f78b4", "#fb9a99", "#e6e6fa", "#b2df8a", "#ffff99", "#b15928", "#e31a1c", "#a865c9", "#33a02c"]
+MANIFEST_NAME = "manifest.json"
+# Part of every tile's source hash: bump it when the tile formats change, so a rebuild rewrites them all.
+TILES_VERSION = 1
+# What forked tile workers share with the process that forked them, see `Plotter.run_tiles`.
+_SHARED = {}
 
 
 def hex_to_rgb(value):
@@ -17,11 +33,19 @@ def hex_to_rgb(value):
     return tuple(int(hex_value[i:i+2], 16) for i in (0, 2, 4))
 
 
-class Plotter:
+class Plotter:  # pylint: disable=too-many-instance-attributes
     """Plots data in png format as well as saving small enough chunks in json format"""
 
-    def __init__(self, bins):
+    def __init__(self, bins, renderer="numpy", workers=1, manifest=None, tile_format="json", clusters=False, fields=None):
         self.bins = bins
+        self.renderer = renderer
+        self.workers = workers
+        # Skips the tiles it holds unchanged, when given.
+        self.manifest = manifest
+        self.tile_format = tile_format
+        # The feature keys of the json tiles, see `feature_keys`.
+        self.fields = feature_keys(fields)
+        self._dictionary = None
         self.model_data = ModelData()
         self.model_data.df["rgb_color"] = self.model_data.df.apply(
             lambda row: hex_to_rgb(row.color), axis=1,
@@ -31,11 +55,17 @@ class Plotter:
             lambda row: COLOR_ORDER.index(row.color.lower()), axis=1,
         )
 
+        # The position of each row as loaded, which `/features?ids=` resolves the ids of the binary tiles with.
+        self.model_data.df["position"] = np.arange(len(self.model_data.df))
+        # Stable, so a change to a few points does not reorder the others in every tile.
         self.model_data.df.sort_values(
             by=["order"],
             ascending=True,
             inplace=True,
+            kind="stable",
         )
+        # The informative rank of each row, to pick the words of clusters, when dense tiles are summarized.
+        self.ranks = informative_ranks(self.model_data) if clusters else None
 
     @staticmethod
     def normalize_to_standard(value, value_min, value_max):
@@ -70,53 +100,119 @@ class Plotter:
 
     def plot_jsons(self, outdir: str, zoom: int, threshold: int) -> pd.DataFrame:
         df = self.model_data.df.copy()
-        zoom_levels = calc_zoom_levels(zoom)
-        for i, x_lines in enumerate(zoom_levels):
-            for j, zoom_ranges in enumerate(x_lines):
+        parts = zoom_splitter(zoom)
+        tiles = len(parts) - 1
+        # Tiles include all their boundaries, so a point on one can fall in several: the first in loop order that is
+        # written takes it.
+        x_edges = [self.normalize_from_standard(part, self.model_data.x_min, self.model_data.x_max) for part in parts]
+        y_edges = [self.normalize_from_standard(part, self.model_data.y_min, self.model_data.y_max) for part in parts]
+        x_first, x_last = tile_ranges(df["x"].to_numpy(), x_edges)
+        y_first, y_last = tile_ranges(df["y"].to_numpy(), y_edges)
+        inside = (x_first <= x_last) & (y_first <= y_last)
+        on_boundary = inside & ((x_first < x_last) | (y_first < y_last))
+
+        # The rows in a single tile, by tile.
+        first_tile = x_first * tiles + y_first
+        binned = np.flatnonzero(inside & ~on_boundary)
+        binned = binned[np.argsort(first_tile[binned], kind="stable")]
+        bounds = np.searchsorted(first_tile[binned], np.arange(tiles ** 2 + 1))
+        # The few rows on boundaries, under each tile they may fall in.
+        boundary_rows = collections.defaultdict(list)
+        for row in np.flatnonzero(on_boundary).tolist():
+            for i in range(x_first[row], x_last[row] + 1):
+                for j in range(y_first[row], y_last[row] + 1):
+                    boundary_rows[i * tiles + j].append(row)
+
+        taken = np.zeros(len(df), dtype=bool)
+        tasks = []
+        cluster_tasks = []
+        for i in range(tiles):
+            for j in range(tiles):
                 print("json plot zoom:", zoom, "i:", i, "j:", j)
-                min_x, max_x, min_y, max_y = self._focus(*zoom_ranges)
-                # Including all boundaries. We won't have overlaps even if this and neighboring tiles will be plotted because the points are masked from the main df.
-                mask = (
-                    (df["x"] >= min_x) &
-                    (df["x"] <= max_x) &
-                    (df["y"] >= min_y) &
-                    (df["y"] <= max_y)
-                )
-
-                plot_df = df[mask]
-                if (threshold != -1 and len(plot_df) >= threshold) or len(plot_df) == 0:
-                    if len(plot_df) >= threshold:
+                rows = binned[bounds[i * tiles + j]:bounds[i * tiles + j + 1]]
+                candidates = [row for row in boundary_rows.get(i * tiles + j, []) if not taken[row]]
+                if candidates:
+                    rows = np.sort(np.concatenate([rows, candidates]))
+
+                filename = os.path.join(outdir, f"space_by_label_{i}_{tiles - 1 - j}")
+                tile_bounds = (x_edges[i], x_edges[i + 1], y_edges[j], y_edges[j + 1])
+                if (threshold != -1 and len(rows) >= threshold) or len(rows) == 0:
+                    if len(rows) >= threshold:
                         print("zoom:", zoom, "i:", i, "j:", j,
-                              "above threshold:", len(plot_df))
+                              "above threshold:", len(rows))
+                    if self.ranks is not None and threshold != -1 and len(rows) >= threshold:
+                        # Summarized, its points are left for the png.
+                        cluster_tasks.append((f"{filename}.clusters.json", rows, tile_bounds))
                     continue
 
-                with open(os.path.join(outdir, f"space_by_label_{i}_{len(x_lines) - 1 - j}.json"), "w", encoding="utf8") as dest:
-                    dest.write(
-                        simplejson.dumps(
-                            {"spaces": df_to_interactive_spaces(
-                                plot_df, self.model_data)},
-                            ignore_nan=True,
-                        ),
-                    )
-                df = df[~mask]
+                if self.tile_format == "binary":
+                    tasks.append((f"{filename}.bin", rows, tile_bounds))
+                else:
+                    tasks.append((f"{filename}.json", rows))
+                taken[rows] = True
+
+        self.write_point_tiles(df, tasks, cluster_tasks)
+        return df[~taken]
+
+    def write_point_tiles(self, df: pd.DataFrame, tasks: list, cluster_tasks: list):
+        """Writes the point tiles of `plot_jsons` in the tile format, and the cluster tiles."""
+        model_bounds = [self.model_data.x_min, self.model_data.x_max, self.model_data.y_min, self.model_data.y_max]
+        if self.tile_format == "binary":
+            self.write_tiles(Plotter.write_binary, df, tasks, ["x", "y", "position", *FEATURE_COLUMNS.values()],
+                             ["binary", *model_bounds, hashlib.sha1(dumps(self.dictionary.to_json())).hexdigest()])
+        else:
+            columns = ["x", "y", *(FEATURE_COLUMNS[key] for key in self.fields if key in FEATURE_COLUMNS)]
+            style = ["json", *model_bounds] if self.fields == FIELD_PRESETS["full"] else ["json", *model_bounds, self.fields]
+            self.write_tiles(Plotter.write_json, df, tasks, columns, style)
+        self.write_tiles(Plotter.write_clusters, df, cluster_tasks, ["x", "y", *FEATURE_COLUMNS.values()],
+                         ["clusters", *model_bounds, CELLS, REPRESENTATIVES])
+
+    def write_json(self, df: pd.DataFrame, filename: str, rows: np.ndarray) -> str:
+        data = dumps(
+            {"spaces": df_to_interactive_spaces(
+                df.iloc[rows], self.model_data, fields=self.fields)},
+        )
+        with open(filename, "wb") as dest:
+            dest.write(data)
 
-        return df
+        return hashlib.sha1(data).hexdigest()
+
+    def write_binary(self, df: pd.DataFrame, filename: str, rows: np.ndarray, bounds: tuple) -> str:
+        spaces = df.iloc[rows]
+        data = encode_tile(spaces, spaces["position"].to_numpy(), self.model_data, self.dictionary, bounds)
+        with open(filename, "wb") as dest:
+            dest.write(data)
+
+        return hashlib.sha1(data).hexdigest()
+
+    def write_clusters(self, df: pd.DataFrame, filename: str, rows: np.ndarray, bounds: tuple) -> str:
+        data = dumps({"clusters": cluster_features(df.iloc[rows], self.ranks[rows], self.model_data, bounds)})  # pylint: disable=unsubscriptable-object
+        with open(filename, "wb") as dest:
+            dest.write(data)
+
+        return hashlib.sha1(data).hexdigest()
+
+    @property
+    def dictionary(self) -> TileDictionary:
+        """The string dictionary shared by the binary tiles, built once."""
+        if self._dictionary is None:
+            self._dictionary = TileDictionary(self.model_data)
+
+        return self._dictionary
 
     def plot_static(self, df: pd.DataFrame, outdir: str, zoom: int) -> str:
         zoom_levels = calc_zoom_levels(zoom)
         radius = 1 + zoom
         uncropped_size = TILE_SIZE * (2 ** zoom)
         df = df.copy()
-        df["plot_x"] = df.apply(lambda row: round(
-            uncropped_size * self.normalize_to_standard(row["x"], self.model_data.x_min, self.model_data.x_max)), axis=1)
-        df["plot_y"] = df.apply(lambda row: round(
-            uncropped_size * self.normalize_to_standard(row["y"], self.model_data.y_min, self.model_data.y_max)), axis=1)
+        df["plot_x"] = np.round(
+            uncropped_size * self.normalize_to_standard(df["x"].to_numpy(dtype=float), self.model_data.x_min, self.model_data.x_max))
+        df["plot_y"] = np.round(
+            uncropped_size * self.normalize_to_standard(df["y"].to_numpy(dtype=float), self.model_data.y_min, self.model_data.y_max))
+        tasks = []
         for i, x_lines in enumerate(zoom_levels):
             for j, zoom_ranges in enumerate(x_lines):
                 print("img plot zoom:", zoom, "i:", i, "j:", j)
-                plt.clf()
-                fig = plt.gcf()
-                fig.set_size_inches(TILE_SIZE, TILE_SIZE)
                 threshold = radius
                 min_x, max_x, min_y, max_y = self._focus(*zoom_ranges)
                 min_x_edge = round(
@@ -134,25 +230,88 @@ class Plotter:
                     (df["plot_y"] > min_y_edge) &
                     (df["plot_y"] < max_y_edge)
                 )
-                plot_df = df[mask]
-                circles = plot_df.apply(
-                    lambda row: self.create_circle(
-                        min_x,  # pylint: disable=cell-var-from-loop
-                        max_x,  # pylint: disable=cell-var-from-loop
-                        min_y,  # pylint: disable=cell-var-from-loop
-                        max_y,  # pylint: disable=cell-var-from-loop
-                        radius,
-                        row,
-                    ),
-                    axis=1,
-                )
-                if len(circles) == 0:
-                    continue
-
-                fig.patches.extend(circles)
                 filename = os.path.join(
                     outdir, f"space_by_label_{i}_{len(x_lines) - 1 - j}.png")
-                fig.savefig(filename, dpi=1, transparent=True)
+                tasks.append((filename, np.flatnonzero(mask.to_numpy()), (min_x, max_x, min_y, max_y), radius))
+
+        self.write_tiles(Plotter.draw_png, df, tasks, ["x", "y", "color"], ["png", self.renderer, COLOR_ORDER])
+
+    def draw_png(self, df: pd.DataFrame, filename: str, rows: np.ndarray, bounds: tuple, radius: int) -> str:
+        """Draws the tile and returns the hash of the file, or None when it has no points and nothing is written."""
+        plot_df = df.iloc[rows]
+        if self.renderer == "numpy":
+            return self.rasterize(plot_df, filename, bounds, radius)
+
+        plt.clf()
+        fig = plt.gcf()
+        fig.set_size_inches(TILE_SIZE, TILE_SIZE)
+        circles = plot_df.apply(
+            lambda row: self.create_circle(*bounds, radius, row),
+            axis=1,
+        )
+        if len(circles) == 0:
+            return None
+
+        fig.patches.extend(circles)
+        fig.savefig(filename, dpi=1, transparent=True)
+        with open(filename, "rb") as source:
+            return hashlib.sha1(source.read()).hexdigest()
+
+    def write_tiles(self, draw, df: pd.DataFrame, tasks: list, columns: list[str], style: list):
+        """Draws the tiles of `tasks`, see `run_tiles`, skipping those the manifest holds unchanged.
+
+        A tile's source hash covers the `columns` of its rows, in order, its task arguments and the `style` of the
+        kind of tile.
+        """
+        if self.manifest is None:
+            self.run_tiles(draw, df, tasks)
+            return
+
+        hashes = row_hashes(df, columns, self.model_data)
+        sources = [
+            hashlib.sha1(dumps([TILES_VERSION, style, task[2:]]) + hashes[task[1]].tobytes()).hexdigest()
+            for task in tasks
+        ]
+        stale = [(task, source) for task, source in zip(tasks, sources) if not self.manifest.unchanged(task[0], source)]
+        outputs = self.run_tiles(draw, df, [task for task, _ in stale])
+        for (task, source), output in zip(stale, outputs):
+            if output is not None:
+                self.manifest.record(task[0], source, output)
+
+    def run_tiles(self, draw, df: pd.DataFrame, tasks: list) -> list:
+        """Calls `draw(self, df, *task)` for each task, over `self.workers` processes, and returns the results in order.
+
+        The workers are forked, so they share `df` and the model data instead of receiving copies; tasks only carry
+        row positions. Each task writes its own file, so the output does not depend on scheduling.
+        """
+        if self.workers <= 1 or len(tasks) <= 1:
+            return [draw(self, df, *task) for task in tasks]
+
+        _SHARED["plotter"], _SHARED["df"] = self, df
+        try:
+            with multiprocessing.get_context("fork").Pool(self.workers) as pool:
+                chunksize = max(1, len(tasks) // (4 * self.workers))
+                return pool.map(_run_tile, [(draw, task) for task in tasks], chunksize=chunksize)
+        finally:
+            _SHARED.clear()
+
+    def rasterize(self, plot_df: pd.DataFrame, filename: str, bounds: tuple, radius: int) -> str:
+        """Draws the circles `create_circle` would with `raster.splat`, all points at once, writes the png and returns
+        its hash."""
+        if len(plot_df) == 0:
+            return None
+
+        min_x, max_x, min_y, max_y = bounds
+        columns = np.round(TILE_SIZE * self.normalize_to_standard(plot_df["x"].to_numpy(dtype=float), min_x, max_x))
+        rows = np.round(TILE_SIZE * self.normalize_to_standard(plot_df["y"].to_numpy(dtype=float), min_y, max_y))
+        groups, colors = color_groups(plot_df["color"])
+        # The figure's y axis points up.
+        image = splat((TILE_SIZE, TILE_SIZE), (columns.astype(np.int64), TILE_SIZE - rows.astype(np.int64)), groups, colors, radius)
+        data = encode_png(image)
+        with open(filename, "wb") as dest:
+            dest.write(data)
+
+        return hashlib.sha1(data).hexdigest()
 
     def create_circle(self, min_x, max_x, min_y, max_y, radius, row):
         opacity = int(0.5 * 255)
@@ -183,6 +342,111 @@ class Plotter:
         )
 
 
+def _run_tile(task):
+    draw, args = task
+    return draw(_SHARED["plotter"], _SHARED["df"], *args)
+
+
+class TileManifest:  # pylint: disable=too-many-instance-attributes
+    """Records, for every tile under `outdir`, the hash of what it was drawn from and the hash of the file, in
+    `path` (`manifest.json` in `outdir` by default), so a rebuild only rewrites the tiles whose points or styling
+    changed.
+
+    Tiles are named by their path under `outdir`, like `3/space_by_label_1_2.png`. With `force` every tile is drawn
+    again, and only reported if its file changed.
+    """
+    def __init__(self, outdir: str, force: bool = False, path: str = None):
+        self.outdir = outdir
+        self.force = force
+        self.path = os.path.join(outdir, MANIFEST_NAME) if path is None else path
+        self.previous = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as source:
+                self.previous = json.load(source)["tiles"]
+
+        self.tiles = {}
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def name(self, filename: str) -> str:
+        return os.path.relpath(filename, self.outdir).replace(os.sep, "/")
+
+    def unchanged(self, filename: str, source: str) -> bool:
+        """Returns whether the tile exists and was drawn from `source`, keeping it if so."""
+        entry = self.previous.get(self.name(filename))
+        if self.force or entry is None or entry["source"] != source or not os.path.exists(filename):
+            return False
+
+        self.tiles[self.name(filename)] = entry
+        return True
+
+    def record(self, filename: str, source: str, output: str):
+        name = self.name(filename)
+        self.tiles[name] = {"source": source, "output": output}
+        if name not in self.previous:
+            self.added.append(name)
+        elif self.previous[name]["output"] != output:
+            self.changed.append(name)
+
+    def finish(self, zooms):
+        """Deletes the tiles of `zooms` that were not drawn again, keeps those of other zooms, and saves the manifest."""
+        for name, entry in self.previous.items():
+            if name in self.tiles:
+                continue
+            if int(name.split("/")[0]) not in zooms:
+                self.tiles[name] = entry
+                continue
+
+            if os.path.exists(os.path.join(self.outdir, name)):
+                os.remove(os.path.join(self.outdir, name))
+            self.removed.append(name)
+
+        with open(self.path, "w", encoding="utf8") as dest:
+            json.dump({"version": TILES_VERSION, "tiles": dict(sorted(self.tiles.items()))}, dest, indent=1)
+
+    def report(self):
+        for kind, names in (("added", self.added), ("changed", self.changed), ("removed", self.removed)):
+            for name in sorted(names):
+                print(f"{kind}: {name}")
+
+        print(f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed,",
+              f"{len(self.tiles) - len(self.added) - len(self.changed)} unchanged")
+
+
+def row_hashes(df: pd.DataFrame, columns: list[str], model_data: ModelData) -> np.ndarray:
+    """Hashes the `columns` of each row, with the lists behind `tax_distribution` ids rather than the ids."""
+    values = df[columns].copy()
+    if "tax_distribution" in columns:
+        ragged = model_data.tax_distribution
+        lengths = np.diff(ragged.offsets)
+        positions = np.arange(ragged.offsets[-1]) - np.repeat(ragged.offsets[:-1], lengths)
+        # A list's hash is the sum of its items' hashes, each weighted by its position.
+        items = item_hashes(ragged) * (2 * positions.astype(np.uint64) + 1)
+        sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(items, dtype=np.uint64)])
+        list_hashes = sums[ragged.offsets[1:]] - sums[ragged.offsets[:-1]] + lengths.astype(np.uint64)
+        ids = values["tax_distribution"].to_numpy(dtype=np.int64)
+        values["tax_distribution"] = np.where(ids >= 0, list_hashes[np.maximum(ids, 0)], np.uint64(0))
+
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def item_hashes(ragged: Ragged) -> np.ndarray:
+    """Hashes the items of the lists of `ragged`, those made of fields such as `[taxon, count]` pairs by combining the
+    hashes of their fields."""
+    hashes = None
+    for field in [ragged.values] if ragged.fields is None else ragged.fields:
+        field = np.asarray(field, dtype=object)
+        # Items that are lists themselves, of varying lengths, are not hashable.
+        if any(isinstance(item, (list, tuple, np.ndarray)) for item in field.tolist()):
+            field = np.array([repr(item) for item in field.tolist()], dtype=object)
+
+        field_hashes = pd.util.hash_array(field)
+        hashes = field_hashes if hashes is None else hashes * np.uint64(0x100000001B3) ^ field_hashes
+
+    return hashes
+
+
 def zoom_splitter(zoom):
     result = [0]
     part = 1 / (2 ** zoom)
@@ -192,6 +456,15 @@ def zoom_splitter(zoom):
     return result
 
 
+def tile_ranges(values: np.ndarray, edges: list) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the first and last tile each value falls in, boundaries included, given the tile edges in ascending order.
+
+    Values outside the edges, or NaN, get a first tile past their last.
+    """
+    edges = np.array(edges)
+    return np.searchsorted(edges[1:], values, side="left"), np.searchsorted(edges[:-1], values, side="right") - 1
+
+
 def zoom_union(parts):
     result = []
     for i in range(len(parts) - 1):
@@ -228,7 +501,12 @@ def calc_zoom_levels(zoom):
 
 
 def plot_everything(args):
-    new_plotter = Plotter(args.bins)
+    manifest = TileManifest(args.outdir, args.force, args.manifest)
+    new_plotter = Plotter(args.bins, args.renderer, args.workers, manifest, args.tile_format, args.clusters, args.fields)
+    if args.tile_format == "binary":
+        os.makedirs(args.outdir, exist_ok=True)
+        with open(os.path.join(args.outdir, DICTIONARY_NAME), "wb") as dest:
+            dest.write(dumps(new_plotter.dictionary.to_json()))
     for zoom in range(args.min_zoom, max(args.min_zoom, args.max_zoom) + 1):
         outdir = os.path.join(args.outdir, str(zoom))
         os.makedirs(outdir, exist_ok=True)
@@ -251,6 +529,11 @@ def plot_everything(args):
         )
         print("finished plotting images at zoom", zoom)
 
+    manifest.finish(range(args.min_zoom, max(args.min_zoom, args.max_zoom) + 1))
+    manifest.report()
+    if args.archive is not None:
+        print("packed", pack(args.outdir, args.archive), "tiles into", args.archive)
+
 
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser()
@@ -265,4 +548,20 @@ if __name__ == "__main__":
                           help="max number of bins")
     argparse.add_argument("--min-img-points", default=2000, type=int,
                           help="Number of points for image. If less a pickle will be created")
+    argparse.add_argument("--renderer", default="numpy", choices=["numpy", "matplotlib"],
+                          help="draw the png tiles with the vectorized rasterizer or one matplotlib patch per point")
+    argparse.add_argument("--workers", default=1, type=int,
+                          help="processes writing the tiles of a zoom in parallel")
+    argparse.add_argument("--force", action="store_true",
+                          help=f"draw every tile again, instead of only those whose points or styling changed since {MANIFEST_NAME} was written")
+    argparse.add_argument("--manifest", default=None, type=str,
+                          help=f"where to keep the manifest of the tiles, {MANIFEST_NAME} in --outdir if omitted")
+    argparse.add_argument("--tile-format", default="json", choices=["json", "binary"],
+                          help="write the point tiles as json features or in the compact binary format of vectortile.py")
+    argparse.add_argument("--clusters", action="store_true",
+                          help="also summarize the tiles over --min-img-points as clusters of points, see clusters.py")
+    argparse.add_argument("--fields", default=None, type=str,
+                          help="attributes of the json point tiles, a preset of common.FIELD_PRESETS or comma separated feature keys")
+    argparse.add_argument("--archive", default=None, type=str,
+                          help="also pack all the tiles in --outdir into this single file, see pyramid.py")
     plot_everything(argparse.parse_args())
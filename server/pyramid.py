@@ -0,0 +1,167 @@
+"""The tile pyramid `plot.py` writes, packed into one file.
+
+The file holds a header, the tiles back to back, the dictionary of the binary tiles if the pyramid has one, then a
+directory of three int64 arrays sorted by tile key: keys, offsets and lengths. Serving a tile is a binary search in the
+memory-mapped directory and one range read of the map. Tiles with the same content are stored once.
+"""
+import hashlib
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+MAGIC = b"GNLPTILE"
+VERSION = 3
+# Magic, version, tile count, directory offset, dictionary offset and length, 0 without a dictionary.
+HEADER = struct.Struct("<8sIIQQQ")
+# The string dictionary of the binary tiles, next to the zoom directories, see vectortile.py.
+DICTIONARY_NAME = "dictionary.json"
+KINDS = ["json", "png", "bin", "clusters.json"]
+MIMETYPES = {"json": "application/json", "png": "image/png", "bin": "application/octet-stream", "clusters.json": "application/json"}
+TILE_NAME = re.compile(r"space_by_label_(\d+)_(\d+)\.(json|png|bin|clusters\.json)")
+
+
+def tile_key(zoom: int, x: int, y: int, kind: str) -> int:
+    """Orders tiles by zoom, then column, then row, then kind."""
+    return ((zoom << 28 | x) << 28 | y) << 2 | KINDS.index(kind)
+
+
+def tile_path(zoom: int, x: int, y: int, kind: str) -> str:
+    """The path of a tile under the output directory of `plot.py`."""
+    return os.path.join(str(zoom), f"space_by_label_{x}_{y}.{kind}")
+
+
+def list_tiles(outdir: str) -> list[tuple[int, int, int, str]]:
+    """Returns the zoom, column, row and kind of the tiles under `outdir`, in key order."""
+    tiles = []
+    for zoom in filter(str.isdigit, os.listdir(outdir)):
+        if not os.path.isdir(os.path.join(outdir, zoom)):
+            continue
+
+        for name in os.listdir(os.path.join(outdir, zoom)):
+            match = TILE_NAME.fullmatch(name)
+            if match is not None:
+                tiles.append((int(zoom), int(match[1]), int(match[2]), match[3]))
+
+    return sorted(tiles, key=lambda tile: tile_key(*tile))
+
+
+def pack(outdir: str, path: str) -> int:
+    """Packs the tiles under `outdir` into the archive at `path` and returns how many there are.
+
+    The archive is written next to `path` and moved over it, so a server mapping the old one keeps reading it.
+    """
+    tiles = list_tiles(outdir)
+    keys = np.array([tile_key(*tile) for tile in tiles], dtype=np.int64)
+    offsets = np.zeros(len(tiles), dtype=np.int64)
+    lengths = np.zeros(len(tiles), dtype=np.int64)
+    stored = {}
+    with open(f"{path}.tmp", "wb") as dest:
+        dest.write(HEADER.pack(MAGIC, VERSION, len(tiles), 0, 0, 0))
+        for i, tile in enumerate(tiles):
+            with open(os.path.join(outdir, tile_path(*tile)), "rb") as source:
+                data = source.read()
+
+            digest = hashlib.sha1(data).digest()
+            if digest not in stored:
+                stored[digest] = (dest.tell(), len(data))
+                dest.write(data)
+            offsets[i], lengths[i] = stored[digest]
+
+        dictionary = (0, 0)
+        if os.path.exists(os.path.join(outdir, DICTIONARY_NAME)):
+            with open(os.path.join(outdir, DICTIONARY_NAME), "rb") as source:
+                dictionary = (dest.tell(), dest.write(source.read()))
+
+        directory = dest.tell()
+        for array in (keys, offsets, lengths):
+            dest.write(array.astype("<i8").tobytes())
+
+        dest.seek(0)
+        dest.write(HEADER.pack(MAGIC, VERSION, len(tiles), directory, *dictionary))
+
+    os.replace(f"{path}.tmp", path)
+    return len(tiles)
+
+
+def extract(path: str, outdir: str) -> int:
+    """Writes the tiles of the archive and its dictionary back as the files `plot.py` would, and returns how many tiles
+    there are."""
+    archive = TileArchive(path)
+    for zoom, x, y, kind in archive.tiles():
+        os.makedirs(os.path.join(outdir, str(zoom)), exist_ok=True)
+        with open(os.path.join(outdir, tile_path(zoom, x, y, kind)), "wb") as dest:
+            dest.write(archive.get(zoom, x, y, kind))
+
+    dictionary = archive.dictionary()
+    if dictionary is not None:
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(outdir, DICTIONARY_NAME), "wb") as dest:
+            dest.write(dictionary)
+
+    return len(archive)
+
+
+class TileArchive:
+    """Reads tiles from an archive written by `pack`, memory mapped. A missing archive holds no tiles."""
+    def __init__(self, path: str):
+        self._path = path
+        self._map = None
+        self._keys = None
+        self._offsets = None
+        self._lengths = None
+        self._dictionary = None
+
+    def load(self):
+        """Maps the archive and its directory, once."""
+        if self._keys is not None:
+            return
+
+        if not os.path.exists(self._path):
+            self._keys = self._offsets = self._lengths = np.zeros(0, dtype=np.int64)
+            return
+
+        with open(self._path, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, directory, *self._dictionary = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self._path} is not a version {VERSION} tile archive")
+
+        self._keys, self._offsets, self._lengths = (
+            np.frombuffer(self._map, dtype="<i8", count=count, offset=directory + i * 8 * count) for i in range(3)
+        )
+
+    def __len__(self):
+        self.load()
+        return len(self._keys)
+
+    def get(self, zoom: int, x: int, y: int, kind: str) -> bytes:
+        """Returns the content of a tile, or None when the archive does not hold it."""
+        self.load()
+        key = tile_key(zoom, x, y, kind)
+        i = np.searchsorted(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+
+        offset, length = int(self._offsets[i]), int(self._lengths[i])
+        return self._map[offset:offset + length]
+
+    def dictionary(self) -> bytes:
+        """Returns the dictionary of the binary tiles, or None when the archive has none."""
+        self.load()
+        if self._dictionary is None or self._dictionary[1] == 0:
+            return None
+
+        offset, length = self._dictionary
+        return self._map[offset:offset + length]
+
+    def tiles(self) -> list[tuple[int, int, int, str]]:
+        """Returns the zoom, column, row and kind of every tile, in key order."""
+        self.load()
+        return [
+            (key >> 58, key >> 30 & (2 ** 28 - 1), key >> 2 & (2 ** 28 - 1), KINDS[key & 3])
+            for key in self._keys.tolist()
+        ]
@@ -0,0 +1,147 @@
+"""Rasterizes the points as the translucent circles `plot.py` draws, with NumPy instead of one matplotlib patch per point."""
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from common import COLOR_ORDER, GREY_HEX, TILE_SIZE, ModelData
+
+GREY_OPACITY = int(0.3 * 255)
+OPACITY = int(0.5 * 255)
+# Samples per pixel side when measuring how much of a pixel a circle covers.
+SUBSAMPLES = 8
+
+
+def disc_coverage(radius: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the offsets of the pixels a circle of `radius` touches, and the fraction of each it covers, for
+    antialiased edges like matplotlib's.
+
+    Centers are pixel corners, like integer coordinates in matplotlib: the pixel at offset (0, 0) is the one below
+    and to the right of the center.
+    """
+    span = np.arange(-radius - 1, radius + 1)
+    samples = (np.arange(SUBSAMPLES) + 0.5) / SUBSAMPLES
+    x_offsets, y_offsets, x_samples, y_samples = np.meshgrid(span, span, samples, samples, indexing="ij")
+    inside = (x_offsets + x_samples) ** 2 + (y_offsets + y_samples) ** 2 <= radius ** 2
+    coverage = inside.mean(axis=(2, 3))
+    touched = coverage > 0
+    return x_offsets[:, :, 0, 0][touched], y_offsets[:, :, 0, 0][touched], coverage[touched]
+
+
+def splat(shape: tuple[int, int], centers: tuple[np.ndarray, np.ndarray], groups: np.ndarray, colors: np.ndarray, radius: int) -> np.ndarray:
+    """Draws a circle of `radius` around each center, group by group in ascending order, and returns the RGBA image.
+
+    `shape` is the image height and width, and `centers` the columns and rows of the circle centers in pixels.
+
+    `colors[group]` is the RGBA color of a group, 0-255. Overlapping circles blend like patches drawn one over another:
+    circles of one color covering fractions `c_k` of a pixel leave it `prod(1 - alpha * c_k)` transparent, which is
+    summed as logarithms.
+    """
+    height, width = shape
+    columns, rows = centers
+    x_offsets, y_offsets, coverage = disc_coverage(radius)
+    image = np.zeros((height * width, 4))
+    for group in np.unique(groups).tolist():
+        selected = groups == group
+        pixel_columns = (columns[selected][:, None] + x_offsets).ravel()
+        pixel_rows = (rows[selected][:, None] + y_offsets).ravel()
+        inside = (pixel_columns >= 0) & (pixel_columns < width) & (pixel_rows >= 0) & (pixel_rows < height)
+        transparency = np.broadcast_to(np.log1p(-colors[group][3] / 255 * coverage), (np.count_nonzero(selected), len(coverage))).ravel()
+        pixels = pixel_rows[inside] * width + pixel_columns[inside]
+        if len(pixels) > height * width:
+            # Dense, a bin per pixel is cheaper than sorting.
+            log_transparency = np.bincount(pixels, transparency[inside], minlength=height * width)
+            covered = np.flatnonzero(log_transparency)
+            log_transparency = log_transparency[covered]
+        else:
+            covered, inverse = np.unique(pixels, return_inverse=True)
+            log_transparency = np.bincount(inverse, transparency[inside])
+
+        alpha = -np.expm1(log_transparency)
+        # Composited over what is drawn so far, with premultiplied colors.
+        image[covered, :3] = colors[group][:3] / 255 * alpha[:, None] + image[covered, :3] * (1 - alpha[:, None])
+        image[covered, 3] = alpha + image[covered, 3] * (1 - alpha)
+
+    opaque = np.flatnonzero(image[:, 3])
+    image[opaque, :3] /= image[opaque, 3:]
+    return np.rint(image * 255).astype(np.uint8).reshape(height, width, 4)
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    """Encodes an 8 bit RGBA image as PNG."""
+    height, width, _ = image.shape
+    # Every scanline starts with filter type 0, none.
+    scanlines = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+        chunk(b"IEND", b""),
+    ])
+
+
+def color_groups(color) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the draw order group of each point and the RGBA color of each group.
+
+    Groups follow `COLOR_ORDER` so grey points are drawn first, and grey is drawn more transparent. Missing colors are
+    grey, and colors missing from `COLOR_ORDER` are drawn last, in order of appearance.
+    """
+    codes, values = pd.factorize(pd.Series(color, dtype=object).fillna(GREY_HEX))
+    lowered = [value.lower() for value in values.tolist()]
+    extra = sorted({value for value in lowered if value not in COLOR_ORDER}, key=lowered.index)
+    palette = COLOR_ORDER + extra
+    groups = np.array([palette.index(value) for value in lowered], dtype=np.int64)[codes]
+    colors = np.array([
+        (*(int(value[i:i + 2], 16) if len(value) == 7 else 0 for i in (1, 3, 5)), GREY_OPACITY if value == GREY_HEX else OPACITY)
+        for value in palette
+    ])
+    return groups, colors
+
+
+class TileRenderer:
+    """Renders the map tiles `plot.py` would draw at a zoom, on request.
+
+    Tile `x`, `y` at zoom `z` follows the `space_by_label_{x}_{y}.png` naming: columns from the left, rows from the top.
+    """
+    def __init__(self, model_data: ModelData, spatial_index):
+        self._model_data = model_data
+        self._spatial_index = spatial_index
+        self._x = None
+        self._y = None
+        self._groups = None
+        self._colors = None
+
+    def load(self):
+        if self._x is not None:
+            return
+
+        model_data = self._model_data
+        self._groups, self._colors = color_groups(model_data.column("color"))
+        self._y = (model_data.column("y").to_numpy(dtype=float) - model_data.y_min) / (model_data.y_max - model_data.y_min)
+        self._x = (model_data.column("x").to_numpy(dtype=float) - model_data.x_min) / (model_data.x_max - model_data.x_min)
+
+    def render(self, zoom: int, x: int, y: int, among: np.ndarray = None) -> np.ndarray:
+        """Returns the RGBA tile, with circles of radius `1 + zoom` pixels and only the rows in `among` if given."""
+        self.load()
+        radius = 1 + zoom
+        tiles = 2 ** zoom
+        # Tile rows count from the top, the data's y axis points up.
+        row = tiles - 1 - y
+        margin = (radius + 1) / tiles
+        rows = self._spatial_index.within(
+            (row / tiles - 1) * TILE_SIZE - margin,
+            x / tiles * TILE_SIZE - margin,
+            ((row + 1) / tiles - 1) * TILE_SIZE + margin,
+            (x + 1) / tiles * TILE_SIZE + margin,
+            among=among,
+        )
+        # Circle centers in pixels, rounded on the whole map at this zoom like `plot_static`.
+        size = TILE_SIZE * tiles
+        columns = np.round(size * self._x[rows]).astype(np.int64) - TILE_SIZE * x
+        pixel_rows = TILE_SIZE - (np.round(size * self._y[rows]).astype(np.int64) - TILE_SIZE * row)
+        return splat((TILE_SIZE, TILE_SIZE), (columns, pixel_rows), self._groups[rows], self._colors, radius)
@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import re
+
+import numpy as np
+
+
+NGRAM_SIZE = 3
+REGEX_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+
+class SearchIndex:
+    """Case-insensitive substring index over the distinct values of a column.
+
+    Values are kept sorted and de-duplicated and every trigram maps to the sorted ids of the
+    values containing it, so matches come out in result order and a page only costs the
+    matches before it.
+    """
+    def __init__(self, column):
+        self.values = sorted({value for value in column.dropna() if isinstance(value, str)})
+        self._lowered = [value.lower() for value in self.values]
+        postings = {}
+        for id_, value in enumerate(self._lowered):
+            for gram in _ngrams(value):
+                postings.setdefault(gram, []).append(id_)
+
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.values)
+
+    def matches(self, filter_: str):
+        """Yields the sorted values matching `filter_` the way `str.contains` would.
+
+        Comma separated terms are alternatives. Filters holding regex syntax are matched as a
+        regex, against the values holding the trigrams of the literals it requires.
+        """
+        if REGEX_CHARS.intersection(filter_):
+            pattern = re.compile(filter_.replace(",", "|"), flags=re.IGNORECASE)
+            ids = (id_ for id_ in self._regex_candidates(pattern.pattern) if pattern.search(self.values[id_]))
+        else:
+            terms = {term.lower() for term in filter_.split(",")}
+            ids = _unique(heapq.merge(*(self._term_ids(term) for term in terms)))
+
+        return (self.values[id_] for id_ in ids)
+
+    def page(self, filter_: str, page: int, page_size: int) -> tuple[list[str], bool]:
+        """Returns the items of the 1-based `page` and whether it is the last one."""
+        start = (page - 1) * page_size
+        items = list(itertools.islice(self.matches(filter_), start, page * page_size + 1))
+        return items[:page_size], len(items) <= page_size
+
+    def _term_ids(self, term):
+        if len(term) < NGRAM_SIZE:
+            return (id_ for id_, value in enumerate(self._lowered) if term in value)
+
+        return (id_ for id_ in self._candidates(_ngrams(term)).tolist() if term in self._lowered[id_])
+
+    def _regex_candidates(self, pattern: str):
+        """Returns the sorted ids of the values holding the trigrams some alternative of `pattern` requires, or all
+        ids when an alternative requires none."""
+        alternatives = []
+        for alternative in _alternatives(pattern):
+            grams = set().union(*(_ngrams(run.lower()) for run in _literal_runs(alternative)))
+            if not grams:
+                return range(len(self.values))
+            alternatives.append(self._candidates(grams).tolist())
+
+        return _unique(heapq.merge(*alternatives))
+
+    def _candidates(self, grams) -> np.ndarray:
+        """Returns the sorted ids of the values holding all of `grams`."""
+        postings = []
+        for gram in grams:
+            if gram not in self._postings:
+                return np.empty(0, dtype=np.int32)
+            postings.append(self._postings[gram])
+
+        postings.sort(key=len)
+        candidates = postings[0]
+        for ids in postings[1:]:
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+
+        return candidates
+
+
+def _alternatives(pattern: str) -> list[str]:
+    """Splits a regex on its top level `|`, leaving those in groups and classes."""
+    alternatives, start, depth, i = [], 0, 0, 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 1
+        elif char == "[":
+            i = _class_end(pattern, i)
+        elif char in "()":
+            depth += 1 if char == "(" else -1
+        elif char == "|" and depth == 0:
+            alternatives.append(pattern[start:i])
+            start = i + 1
+        i += 1
+
+    alternatives.append(pattern[start:])
+    return alternatives
+
+
+def _literal_runs(alternative: str) -> list[str]:
+    """Returns runs of literal characters whatever a regex without top level `|` matches contains. Scanning stops at
+    the first group, and escapes other than of punctuation end a run, so some required literals may be missed but
+    never one that is not required.
+    """
+    runs, run, i = [], "", 0
+    while i < len(alternative) and alternative[i] != "(":
+        char = alternative[i]
+        if char in "?*{":
+            # The last literal may be repeated zero times.
+            runs.append(run[:-1])
+            run = ""
+            if char == "{":
+                i = alternative.find("}", i)
+                if i == -1:
+                    break
+        elif char == "\\" and i + 1 < len(alternative) and not alternative[i + 1].isalnum():
+            run += alternative[i + 1]
+            i += 1
+        elif char == "\\":
+            # Classes, anchors, code points and references, whatever letters and digits follow.
+            runs.append(run)
+            run = ""
+            i += 1
+            while i + 1 < len(alternative) and alternative[i + 1].isalnum():
+                i += 1
+        elif char in REGEX_CHARS:
+            runs.append(run)
+            run = ""
+            if char == "[":
+                i = _class_end(alternative, i)
+        else:
+            run += char
+        i += 1
+
+    runs.append(run)
+    return [run for run in runs if run]
+
+
+def _class_end(pattern: str, start: int) -> int:
+    """Returns the position of the `]` closing the class opened at `start`."""
+    i = start + 1
+    if pattern[i:i + 1] == "^":
+        i += 1
+    if pattern[i:i + 1] == "]":
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+
+    return i
+
+
+def _ngrams(value):
+    return {value[i:i + NGRAM_SIZE] for i in range(len(value) - NGRAM_SIZE + 1)}
+
+
+def _unique(sorted_ids):
+    return (id_ for id_, _ in itertools.groupby(sorted_ids))
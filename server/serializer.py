@@ -0,0 +1,60 @@
+"""JSON encoding shared by the API and the tile writer: orjson when installed, the stdlib json module otherwise.
+
+Either way NumPy scalars and arrays are encoded as plain numbers and lists, and NaN and infinities as null.
+"""
+import json
+import math
+
+from flask.json.provider import DefaultJSONProvider
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, sort_keys: bool = False) -> bytes:
+    if orjson is not None:
+        # pylint: disable=no-member
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=_default, option=option)
+
+    return json.dumps(_finite(obj), default=_default, sort_keys=sort_keys, separators=(",", ":")).encode("utf8")
+
+
+def _finite(obj):
+    """Replaces NaN and infinities with None all the way down, which the json module has no option for."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return _finite(_default(obj))
+
+    return obj
+
+
+def _default(obj):
+    """Encodes what neither encoder handles natively; orjson only asks for non contiguous arrays and pandas values."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider on top of `dumps`, keeping `jsonify`'s sorted keys and compact output."""
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj, sort_keys=self.sort_keys).decode("utf8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, sort_keys=self.sort_keys) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,125 @@
+import numpy as np
+
+from common import GREY_HEX, ModelData, df_coord_to_latlng
+
+
+class SpatialIndex:  # pylint: disable=too-many-instance-attributes
+    """Buckets the map coordinates of the points (see `df_coord_to_latlng`) into a uniform grid of square cells,
+    so a viewport or a nearest point search only looks at the points of the cells around it.
+
+    Rows are also ranked by how informative they are, so a query can keep the best `limit` of its points.
+    """
+    def __init__(self, model_data: ModelData, cells: int = 256):
+        self._model_data = model_data
+        self._cells = cells
+        self._lat = None
+        self._lng = None
+        self._ranks = None
+        self._origin = None
+        self._cell_size = None
+        self._rows = None
+        self._bounds = None
+
+    def load(self):
+        """Computes the coordinates and buckets them, once."""
+        if self._rows is not None:
+            return
+
+        lat, lng = df_coord_to_latlng(
+            self._model_data.column("y").to_numpy(dtype=float),
+            self._model_data.column("x").to_numpy(dtype=float),
+            self._model_data,
+        )
+        valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lng)))
+        self._lat, self._lng = lat, lng
+        self._ranks = informative_ranks(self._model_data)
+        if len(valid) == 0:
+            self._origin, self._cell_size = (0.0, 0.0), 1.0
+        else:
+            self._origin = (lat[valid].min(), lng[valid].min())
+            extent = max(lat[valid].max() - self._origin[0], lng[valid].max() - self._origin[1])
+            self._cell_size = extent / self._cells if extent > 0 else 1.0
+
+        # Rows sorted by cell, row major, so a row of cells is one contiguous slice.
+        cell_ids = self._cell(lat[valid], 0) * self._cells + self._cell(lng[valid], 1)
+        order = np.argsort(cell_ids, kind="stable")
+        self._rows = valid[order]
+        self._bounds = np.searchsorted(cell_ids[order], np.arange(self._cells ** 2 + 1))
+
+    def within(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float, *, limit: int = None, among: np.ndarray = None) -> np.ndarray:
+        """Returns the rows inside the box, bounds included, the most informative first.
+
+        `limit` keeps only the first rows and `among` restricts the result to the given rows.
+        """
+        self.load()
+        min_lat, max_lat = sorted((min_lat, max_lat))
+        min_lng, max_lng = sorted((min_lng, max_lng))
+        first_row, last_row = self._cell(np.array([min_lat, max_lat]), 0).tolist()
+        first_column, last_column = self._cell(np.array([min_lng, max_lng]), 1).tolist()
+        rows = self._window(first_row, last_row, first_column, last_column)
+        lat, lng = self._lat[rows], self._lng[rows]
+        rows = rows[(lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng)]
+        if among is not None:
+            rows = rows[np.isin(rows, among)]
+
+        return self._most_informative(rows, limit)
+
+    def nearest(self, lat: float, lng: float, k: int = 1, radius: float = None) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the `k` rows closest to the point, within `radius` if given, and their distances, closest first.
+
+        The search looks at a window of cells around the point, doubling it until no point outside could be closer
+        than the `k`th found.
+        """
+        self.load()
+        k = max(k, 0)
+        row, column = self._cell(np.array([lat]), 0)[0], self._cell(np.array([lng]), 1)[0]
+        reach = 0
+        while True:
+            rows = self._window(max(row - reach, 0), min(row + reach, self._cells - 1), max(column - reach, 0), min(column + reach, self._cells - 1))
+            distances = np.hypot(self._lat[rows] - lat, self._lng[rows] - lng)
+            # Points outside the window are more than `reach` cells away.
+            covered = reach * self._cell_size
+            if k == 0 or reach >= self._cells or (radius is not None and covered >= radius):
+                break
+            if len(rows) >= k and np.partition(distances, k - 1)[k - 1] <= covered:
+                break
+
+            reach = max(2 * reach, 1)
+
+        if radius is not None:
+            rows, distances = rows[distances <= radius], distances[distances <= radius]
+
+        order = np.lexsort((rows, distances))[:k]
+        return rows[order], distances[order]
+
+    def _window(self, first_row: int, last_row: int, first_column: int, last_column: int) -> np.ndarray:
+        """Returns the rows of the cells in the given ranges, bounds included."""
+        return np.concatenate([self._rows[:0]] + [
+            self._rows[self._bounds[i * self._cells + first_column]:self._bounds[i * self._cells + last_column + 1]]
+            for i in range(first_row, last_row + 1)
+        ])
+
+    def _cell(self, values: np.ndarray, axis: int) -> np.ndarray:
+        cells = np.floor((values - self._origin[axis]) / self._cell_size)
+        return np.clip(cells, 0, self._cells - 1).astype(np.int64)
+
+    def _most_informative(self, rows: np.ndarray, limit: int = None) -> np.ndarray:
+        ranks = self._ranks[rows]
+        if limit is not None and limit < len(rows):
+            keep = np.argpartition(ranks, max(limit, 0))[:max(limit, 0)]
+            rows, ranks = rows[keep], ranks[keep]
+
+        return rows[np.argsort(ranks)]
+
+
+def informative_ranks(model_data: ModelData) -> np.ndarray:
+    """Ranks the rows from the most informative, 0, down: colored points before grey ones, then significant ones,
+    then the more frequent words, ties kept in row order.
+    """
+    colored = model_data.column("color").astype(object).str.lower().fillna(GREY_HEX).ne(GREY_HEX).to_numpy(dtype=bool)
+    significant = model_data.column("significant").to_numpy(dtype=bool, na_value=False)
+    word_count = model_data.column("word_count").to_numpy(dtype=float, na_value=-1)
+    order = np.lexsort((-word_count, ~significant, ~colored))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    return ranks
@@ -0,0 +1,268 @@
+"""Directories of memory-mappable `.npy` arrays, used for the packed serving data."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def save_array(path: str, name: str, array: np.ndarray):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, f"{name}.npy"), array, allow_pickle=False)
+
+
+def load_array(path: str, name: str, mmap: bool = True) -> np.ndarray:
+    return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+
+
+def has_array(path: str, name: str) -> bool:
+    return os.path.exists(os.path.join(path, f"{name}.npy"))
+
+
+def save_strings(path: str, name: str, values):
+    """Saves strings as NUL terminated utf8 bytes plus offsets, with a validity mask when some are missing."""
+    valid = np.array([isinstance(value, str) for value in values], dtype=bool)
+    encoded = [(value.encode("utf8") if is_valid else b"") + b"\0" for value, is_valid in zip(values, valid)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    save_array(path, f"{name}.offsets", offsets)
+    save_array(path, f"{name}.bytes", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    if not valid.all():
+        save_array(path, f"{name}.valid", valid)
+
+
+def load_strings(path: str, name: str) -> list:
+    offsets = load_array(path, f"{name}.offsets")
+    data = load_array(path, f"{name}.bytes").tobytes()
+    # Splitting on the terminators decodes in one pass, unless a value holds a NUL itself.
+    values = data.decode("utf8").split("\0")[:-1]
+    if len(values) != len(offsets) - 1:
+        offsets = offsets.tolist()
+        values = [data[start:end - 1].decode("utf8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+    if has_array(path, f"{name}.valid"):
+        for i in np.flatnonzero(np.logical_not(load_array(path, f"{name}.valid"))).tolist():
+            values[i] = None
+
+    return values
+
+
+def save_categories(path: str, name: str, values):
+    """Saves repetitive strings as int32 codes into a table of their distinct values, -1 marking missing ones."""
+    codes, categories = pd.factorize(pd.Series(values, dtype=object))
+    save_array(path, f"{name}.codes", codes.astype(np.int32))
+    save_strings(path, f"{name}.categories", list(categories))
+
+
+def load_categories(path: str, name: str) -> pd.Categorical:
+    return pd.Categorical.from_codes(load_array(path, f"{name}.codes"), load_strings(path, f"{name}.categories"))
+
+
+def save_flags(path: str, name: str, values):
+    """Saves a nullable boolean column as int8, -1 marking missing values."""
+    flags = np.array([-1 if pd.isnull(value) else int(value) for value in values], dtype=np.int8)
+    save_array(path, name, flags)
+
+
+def load_flags(path: str, name: str) -> pd.arrays.BooleanArray:
+    flags = load_array(path, name)
+    return pd.arrays.BooleanArray(flags == 1, flags == -1)
+
+
+class Ragged:
+    """A column of lists kept as flat arrays plus offsets instead of a Python list per row.
+
+    Rows refer to their list by id, -1 marking a missing list. Scalar items are in `values`. Items that are sequences of
+    one length, like the `[taxon, count]` pairs of `tax_distribution`, have one array per position in `fields` instead,
+    so each keeps its type, and `values` is None.
+    """
+    def __init__(self, offsets: np.ndarray, values: np.ndarray, valid: np.ndarray, fields: list[np.ndarray] = None):
+        self.offsets = offsets
+        self.values = values
+        self.valid = valid
+        self.fields = fields
+
+    @classmethod
+    def from_lists(cls, values) -> "Ragged":
+        """Packs `values`, where anything but a list or array is a missing list."""
+        valid = np.array([isinstance(value, (list, np.ndarray)) for value in values], dtype=bool)
+        lists = [list(value) if is_valid else [] for value, is_valid in zip(values, valid)]
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in lists], out=offsets[1:])
+        flat = [item for value in lists for item in value]
+        if flat and all(isinstance(item, (list, tuple, np.ndarray)) for item in flat) and len({len(item) for item in flat}) == 1:
+            return cls(offsets, None, valid, [_items_array([item[i] for item in flat]) for i in range(len(flat[0]))])
+
+        return cls(offsets, _items_array(flat), valid)
+
+    def __len__(self):
+        return len(self.valid)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.where(self.valid, np.arange(len(self)), -1).astype(np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        items = [self.values] if self.fields is None else self.fields
+        return self.offsets.nbytes + self.valid.nbytes + sum(array.nbytes for array in items)
+
+    def gather(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the offsets of the lists `ids` refer to once put back to back, the positions of their items in the
+        flat arrays and which ids are valid."""
+        valid = ids >= 0
+        ids = np.where(valid, ids, 0)
+        starts = self.offsets[ids]
+        lengths = np.where(valid, self.offsets[ids + 1] - starts, 0)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return offsets, np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1]), valid
+
+    def take(self, ids) -> list:
+        offsets, positions, valid = self.gather(np.asarray(ids))
+        if self.fields is None:
+            items = self.values[positions].tolist()
+        else:
+            items = [list(item) for item in zip(*(field[positions].tolist() for field in self.fields))]
+
+        offsets = offsets.tolist()
+        return [
+            items[start:end] if is_valid else None
+            for start, end, is_valid in zip(offsets[:-1], offsets[1:], valid.tolist())
+        ]
+
+
+def _items_array(items: list) -> np.ndarray:
+    """Keeps strings and numbers in arrays of their own type, and anything else as objects."""
+    if all(isinstance(item, str) for item in items):
+        return np.array(items, dtype=object)
+    if all(isinstance(item, (bool, int, float, np.bool_, np.number)) for item in items):
+        return np.asarray(items)
+
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+
+    return array
+
+
+def save_ragged(path: str, name: str, ragged: Ragged):
+    save_array(path, f"{name}.offsets", ragged.offsets)
+    save_array(path, f"{name}.valid", ragged.valid)
+    if ragged.fields is None:
+        _save_items(path, f"{name}.values", ragged.values)
+    else:
+        for i, field in enumerate(ragged.fields):
+            _save_items(path, f"{name}.fields.{i}", field)
+
+
+def load_ragged(path: str, name: str) -> Ragged:
+    offsets, valid = load_array(path, f"{name}.offsets"), load_array(path, f"{name}.valid")
+    if _has_items(path, f"{name}.values"):
+        return Ragged(offsets, _load_items(path, f"{name}.values"), valid)
+
+    fields = []
+    while _has_items(path, f"{name}.fields.{len(fields)}"):
+        fields.append(_load_items(path, f"{name}.fields.{len(fields)}"))
+
+    return Ragged(offsets, None, valid, fields)
+
+
+def _save_items(path: str, name: str, items: np.ndarray):
+    if items.dtype != object:
+        save_array(path, name, items)
+    elif all(isinstance(item, str) for item in items.tolist()):
+        save_strings(path, name, items.tolist())
+    else:
+        raise ValueError(f"list items of {name} cannot be stored without pickling")
+
+
+def _load_items(path: str, name: str) -> np.ndarray:
+    if has_array(path, name):
+        return load_array(path, name)
+
+    return np.array(load_strings(path, name), dtype=object)
+
+
+def _has_items(path: str, name: str) -> bool:
+    return has_array(path, name) or has_array(path, f"{name}.offsets")
+
+
+def column_kind(column: pd.Series) -> str:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return "categories"
+    if isinstance(column.dtype, pd.BooleanDtype):
+        return "flags"
+    if column.dtype != object and not isinstance(column.dtype, pd.StringDtype):
+        return "array"
+
+    present = [value for value in column if isinstance(value, (list, np.ndarray)) or not pd.isnull(value)]
+    if present and all(isinstance(value, (list, np.ndarray)) for value in present):
+        return "ragged"
+    if all(isinstance(value, (bool, np.bool_)) for value in present):
+        return "flags"
+    if all(isinstance(value, str) for value in present):
+        return "categories" if len(set(present)) <= len(column) // 2 else "strings"
+
+    raise ValueError(f"column {column.name} holds values that cannot be stored without pickling")
+
+
+SAVERS = {
+    "array": lambda path, name, column: save_array(path, name, column.to_numpy()),
+    "strings": lambda path, name, column: save_strings(path, name, column.tolist()),
+    "categories": lambda path, name, column: save_categories(path, name, column.tolist()),
+    "flags": lambda path, name, column: save_flags(path, name, column.tolist()),
+    "ragged": lambda path, name, column: save_ragged(path, name, Ragged.from_lists(column.tolist())),
+}
+LOADERS = {
+    "array": load_array,
+    "strings": lambda path, name: np.array(load_strings(path, name), dtype=object),
+    "categories": load_categories,
+    "flags": load_flags,
+    # Ragged columns hold list ids, the lists themselves come from `Table.ragged`.
+    "ragged": lambda path, name: load_ragged(path, name).ids,
+}
+
+
+def save_table(path: str, df: pd.DataFrame):
+    """Saves every column of `df` in its own files, described by `columns.json`."""
+    os.makedirs(path, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        kind = column_kind(df[name])
+        SAVERS[kind](path, f"{i}", df[name])
+        columns.append({"name": name, "kind": kind})
+
+    with open(os.path.join(path, "columns.json"), "w", encoding="utf8") as dest:
+        json.dump(columns, dest)
+
+
+class Table:
+    """A table saved by `save_table`. Columns are decoded on first access, numeric ones stay memory-mapped."""
+    def __init__(self, path: str):
+        self._path = path
+        with open(os.path.join(path, "columns.json"), encoding="utf8") as src:
+            self._kinds = {column["name"]: (i, column["kind"]) for i, column in enumerate(json.load(src))}
+
+        self._columns = {}
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self._kinds)
+
+    def column(self, name: str) -> pd.Series:
+        if name not in self._columns:
+            i, kind = self._kinds[name]
+            self._columns[name] = pd.Series(LOADERS[kind](self._path, f"{i}"), name=name, copy=False)
+
+        return self._columns[name]
+
+    def ragged(self, name: str) -> Ragged:
+        i, kind = self._kinds[name]
+        if kind != "ragged":
+            raise ValueError(f"column {name} is not a column of lists")
+
+        return load_ragged(self._path, f"{i}")
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({name: self.column(name) for name in self.columns}, copy=False)
@@ -0,0 +1,81 @@
+"""A small model data frame shaped like the production pickle, run with `pipenv run pytest` from `server`."""
+import importlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import ModelData
+
+CLASSES = ["unknown", "Defense", "Secretion", "CRISPR"]
+COLORS = ["#808080", "#6a3d9a", "#ffc067", "#ff1493"]
+TAXA = ["Bacteria", "Archaea", "Viruses"]
+
+
+def make_frame(size: int = 60, seed: int = 0) -> pd.DataFrame:
+    """Missing values in every nullable column, `[taxon, count]` pairs, empty and missing distributions."""
+    rng = np.random.default_rng(seed)
+    classes = rng.integers(0, len(CLASSES), size)
+    hypothetical = [i % 3 == 0 for i in range(size)]
+    return pd.DataFrame({
+        "word": [f"hypo_{i}" if hypothetical[i] else f"K{i:05d}.{i % 4}" for i in range(size)],
+        "x": rng.normal(size=size),
+        "y": rng.normal(size=size),
+        "KO": [None if hypothetical[i] else f"K{i:05d}" for i in range(size)],
+        "product": [None if hypothetical[i] else f"product {i % 5}" for i in range(size)],
+        "gene_name": [None if hypothetical[i] or i % 5 == 0 else f"gn{i % 7}" for i in range(size)],
+        "significant": [None if i % 11 == 0 else bool(i % 2) for i in range(size)],
+        "ncbi_nr": [f"nr desc {i}" if hypothetical[i] else None for i in range(size)],
+        "predicted_class": [CLASSES[class_] for class_ in classes],
+        "color": [COLORS[class_] for class_ in classes],
+        "hypothetical": hypothetical,
+        "word_count": [np.nan if i % 13 == 0 else float(i % 40) for i in range(size)],
+        "tax_distribution": [
+            np.nan if i % 4 == 0 else [] if i % 17 == 0 else [[taxon, int(rng.integers(1, 50))] for taxon in TAXA[:1 + i % 3]]
+            for i in range(size)
+        ],
+        "tax_ratio": [np.nan if i % 9 == 0 else float(rng.random()) for i in range(size)],
+        "gene_product": [None if hypothetical[i] else f"product {i % 5}" for i in range(size)],
+    })
+
+
+@pytest.fixture(name="raw_frame")
+def fixture_raw_frame() -> pd.DataFrame:
+    return make_frame()
+
+
+def pickled_model_data(frame: pd.DataFrame, path) -> ModelData:
+    frame.to_pickle(path)
+    return ModelData(str(path))
+
+
+@pytest.fixture(name="model_data")
+def fixture_model_data(raw_frame, tmp_path) -> ModelData:
+    return pickled_model_data(raw_frame, tmp_path / "model_data.pkl")
+
+
+@pytest.fixture(name="client", scope="session")
+def fixture_client(tmp_path_factory):
+    """A test client of the app, loaded from pickles of `make_frame` like a deployment without a bundle."""
+    path = tmp_path_factory.mktemp("data")
+    make_frame().to_pickle(path / "model_data.pkl")
+    with open(path / "label_to_word.pkl", "wb") as dest:
+        pickle.dump({class_: None for class_ in CLASSES}, dest)
+    with open(path / "gene_names_to_ko.pkl", "wb") as dest:
+        pickle.dump({f"gn{i}": f"K{i:05d}" for i in range(7)}, dest)
+
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        app = importlib.import_module("app")
+        yield app.app.test_client()
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(name="app_module")
+def fixture_app_module(client):  # pylint: disable=unused-argument
+    """The app module `client` serves, to swap its data for a test with `monkeypatch`."""
+    return importlib.import_module("app")
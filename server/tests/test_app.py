@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from common import PredictionSummary
+from pyramid import TileArchive, pack
+
+PNG = b"\x89PNG drawn by plot.py"
+# Not what the model data of the app would give, as the tiles may be older than it.
+DICTIONARY = b'{"product": ["written with the tiles"]}'
+
+
+@pytest.mark.parametrize("query", [
+    {"type": "word", "value": "K00001.1", "options": [1]},
+    {"type": "neighbors", "value": "K00001.1", "options": {"k": "x"}},
+    {"type": "neighbors", "value": "K00001.1", "options": {"k": [3]}},
+    {"type": "unknown", "value": "K00001.1"},
+    {"type": "word", "value": 3},
+])
+def test_batch_rejects_bad_queries(client, query):
+    assert client.post("/batch", json={"queries": [query]}).status_code == 400
+
+
+def test_batch_matches_routes(client):
+    queries = [{"type": "word", "value": "K00001.1"}, {"type": "label", "value": "Defense"}]
+    results = client.post("/batch", json={"queries": queries}).get_json()["results"]
+    assert results == [client.get("/word/get/K00001.1").get_json(), client.get("/label/get/Defense").get_json()]
+
+
+@pytest.mark.parametrize("query", [
+    "/spaces/bbox?min_lat=nan&min_lng=0&max_lat=1&max_lng=1",
+    "/spaces/bbox?min_lat=0&min_lng=-inf&max_lat=1&max_lng=1",
+    "/spaces/bbox?min_lat=0&min_lng=0&max_lat=1&max_lng=infinity",
+    "/spaces/nearest?lat=nan&lng=0",
+    "/spaces/nearest?lat=0&lng=inf",
+    "/spaces/nearest?lat=0&lng=0&radius=nan",
+])
+def test_spaces_reject_non_finite_coordinates(client, query):
+    assert client.get(query).status_code == 400
+
+
+@pytest.fixture(name="prediction_summary")
+def fixture_prediction_summary(app_module, tmp_path, monkeypatch):
+    """Predicts K00001.1 but not K00002.2."""
+    summary_df = pd.DataFrame({"word": ["K00001.1"], "prediction_summary": [{"Defense": 0.5, "CRISPR": 0.25}]})
+    summary_df.to_pickle(tmp_path / "prediction_summary.pkl")
+    monkeypatch.setattr(app_module, "PREDICTION_SUMMARY", PredictionSummary(str(tmp_path / "missing"), str(tmp_path / "prediction_summary.pkl")))
+
+
+@pytest.mark.usefixtures("prediction_summary")
+def test_scatter_of_a_word_without_predictions(client):
+    assert client.get("/plot/scatter/K00002.2").status_code == 404
+
+    queries = [{"type": "scatter", "value": "K00001.1"}, {"type": "scatter", "value": "K00002.2"}, {"type": "word", "value": "K00002.2"}]
+    response = client.post("/batch", json={"queries": queries})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0] == client.get("/plot/scatter/K00001.1").get_json()
+    assert results[1] == {"error": "no predictions for 'K00002.2'"}
+    assert results[2] == client.get("/word/get/K00002.2").get_json()
+
+
+@pytest.fixture(name="archive")
+def fixture_archive(app_module, tmp_path, monkeypatch):
+    """Serves an archive holding the png of tile 1/1/1, the json tile of 1/0/0 and a dictionary."""
+    (tmp_path / "map" / "1").mkdir(parents=True)
+    (tmp_path / "map" / "1" / "space_by_label_1_1.png").write_bytes(PNG)
+    (tmp_path / "map" / "1" / "space_by_label_0_0.json").write_bytes(b'{"spaces": []}')
+    (tmp_path / "map" / "dictionary.json").write_bytes(DICTIONARY)
+    pack(str(tmp_path / "map"), str(tmp_path / "tiles.pyramid"))
+    monkeypatch.setattr(app_module, "TILE_ARCHIVE", TileArchive(str(tmp_path / "tiles.pyramid")))
+
+
+@pytest.mark.usefixtures("archive")
+def test_png_tiles_only_come_from_the_archive(client):
+    assert client.get("/tiles/1/1/1.png").data == PNG
+    # Its points are in the json tile.
+    assert client.get("/tiles/1/0/0.png").status_code == 404
+    assert client.get("/tiles/1/0/0.json").data == b'{"spaces": []}'
+    assert client.get("/tiles/1/0/0.png?label=Defense").mimetype == "image/png"
+
+
+def test_png_tiles_are_rendered_without_an_archive(client):
+    response = client.get("/tiles/2/1/2.png")
+    assert response.status_code == 200
+    assert response.data.startswith(b"\x89PNG")
+
+
+@pytest.mark.usefixtures("archive")
+def test_the_dictionary_comes_from_the_archive(client):
+    assert client.get("/tiles/dictionary.json").data == DICTIONARY
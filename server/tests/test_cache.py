@@ -0,0 +1,68 @@
+import gzip
+
+import pytest
+
+from cache import ResponseCache
+
+LABEL = "/label/get/Defense"
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(app_module) -> ResponseCache:
+    """The response cache of the app, emptied for a test."""
+    app_module.RESPONSE_CACHE.clear()
+    yield app_module.RESPONSE_CACHE
+    app_module.RESPONSE_CACHE.clear()
+
+
+def test_etag_answers_304(client, cache):
+    response = client.get(LABEL)
+    assert response.status_code == 200 and response.headers["ETag"]
+
+    again = client.get(LABEL, headers={"If-None-Match": response.headers["ETag"]})
+    assert again.status_code == 304 and not again.data
+    assert again.headers["ETag"] == response.headers["ETag"]
+    assert cache.stats()["not_modified"] == 1
+
+
+def test_encodings_are_separate_entries(client, cache):
+    identity = client.get(LABEL, headers={"Accept-Encoding": "identity"})
+    encoded = client.get(LABEL, headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in identity.headers and encoded.headers["Content-Encoding"] == "gzip"
+    assert identity.headers["ETag"] != encoded.headers["ETag"]
+    assert gzip.decompress(encoded.data) == identity.data
+    assert cache.stats()["entries"] == 2
+
+    # Each is then a hit, and their ETags only match their own encoding.
+    assert client.get(LABEL, headers={"Accept-Encoding": "gzip"}).data == encoded.data
+    assert cache.stats()["hits"] == 1
+    stale = client.get(LABEL, headers={"Accept-Encoding": "gzip", "If-None-Match": identity.headers["ETag"]})
+    assert stale.status_code == 200
+
+
+def test_least_recently_used_entries_are_evicted(client, cache, monkeypatch):
+    paths = ["/word/get/K00001.1", "/word/get/K00002.2"]
+    sizes = []
+    for path in paths:
+        cache.clear()
+        client.get(path, headers={"Accept-Encoding": "identity"})
+        sizes.append(cache.stats()["bytes"])
+    # Room for either entry, but not both.
+    cache.clear()
+    monkeypatch.setattr(cache, "max_bytes", max(sizes))
+
+    first = client.get(paths[0], headers={"Accept-Encoding": "identity"})
+    client.get(paths[1], headers={"Accept-Encoding": "identity"})
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["entries"] == 1 and stats["bytes"] == sizes[1]
+
+    assert client.get(paths[0], headers={"Accept-Encoding": "identity"}).data == first.data
+    assert cache.stats()["misses"] == 3 and cache.stats()["hits"] == 0
+
+
+@pytest.mark.parametrize("path", [f"{LABEL}?stream=ndjson", "/features?ids=x", "/features?ids=100000"])
+def test_streamed_and_failed_responses_are_not_cached(client, cache, path):
+    status_code = client.get(path).status_code
+    assert client.get(path).status_code == status_code
+    assert cache.stats()["entries"] == 0 and cache.stats()["hits"] == 0
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from columnar import arrow_spaces
+from common import FEATURE_DEFAULTS, df_to_interactive_spaces
+
+pa = pytest.importorskip("pyarrow")
+
+
+def test_arrow_matches_json(model_data):
+    spaces = model_data.df.iloc[::2]
+    features = df_to_interactive_spaces(spaces, model_data)
+    table = pa.ipc.open_stream(arrow_spaces(spaces, model_data)).read_all()
+    assert str(table.schema.field("tax_distribution").type) == "large_list<item: struct<name: string, count: int64>>"
+
+    columns = table.to_pydict()
+    columns["tax_distribution"] = [
+        None if pairs is None else [[pair["name"], pair["count"]] for pair in pairs] for pairs in columns["tax_distribution"]
+    ]
+    for i, feature in enumerate(features):
+        values = {key: FEATURE_DEFAULTS.get(key) if columns[key][i] is None else columns[key][i] for key in feature["value"]}
+        assert values == feature["value"]
+        assert np.allclose([columns["x"][i], columns["y"][i]], [feature["x"], feature["y"]], rtol=1e-6)
@@ -0,0 +1,101 @@
+# The baseline row_to_feature is copied on purpose, so it must not follow common.py.
+# pylint: disable=duplicate-code
+import argparse
+import json
+import math
+
+import pandas as pd
+import pytest
+
+from build import build_predictions
+from common import FIELD_PRESETS, ModelData, PredictionSummary, df_to_interactive_spaces, feature_keys
+from conftest import make_frame
+from store import save_table
+
+
+def baseline_feature(row, frame: pd.DataFrame) -> dict:
+    """`row_to_feature` as it was before the frame was normalized, on a row of the raw pickle."""
+    y_coord = (row.y - frame["y"].max()) / (frame["y"].min() - frame["y"].max()) * -512
+    x_coord = (row.x - frame["x"].min()) / (frame["x"].max() - frame["x"].min()) * 512
+    return {
+        "id": row.word,
+        "x": x_coord,
+        "y": y_coord,
+        "value": {
+            "name": f"{x_coord},{y_coord}",
+            "word": row.word,
+            "ko": row.KO if not pd.isnull(row.KO) else None,
+            "product": row["product"] if not pd.isnull(row["product"]) else None,
+            "gene_name": row.gene_name if not pd.isnull(row.gene_name) else None,
+            "significant": row.significant if not pd.isnull(row.significant) else None,
+            "ncbi_nr": row.ncbi_nr if not pd.isnull(row.ncbi_nr) else None,
+            "predicted_class": row.predicted_class if not pd.isnull(row.predicted_class) else None,
+            "color": row.color if not pd.isnull(row.color) else None,
+            "hypothetical": row.hypothetical if not pd.isnull(row.hypothetical) else None,
+            "word_count": row.word_count if not pd.isnull(row.word_count) else -1,
+            "tax_distribution": row.tax_distribution if not isinstance(pd.isnull(row.tax_distribution), bool) else None,
+            "tax_ratio": row.tax_ratio if not pd.isnull(row.tax_ratio) else -1,
+        },
+    }
+
+
+def assert_same_features(features: list[dict], expected: list[dict]):
+    """Compares through JSON, so types must match as the client sees them, with coordinates up to rounding."""
+    features, expected = json.loads(json.dumps(features)), json.loads(json.dumps(expected))
+    assert len(features) == len(expected)
+    for feature, reference in zip(features, expected):
+        assert math.isclose(feature.pop("x"), reference.pop("x"), rel_tol=1e-9)
+        assert math.isclose(feature.pop("y"), reference.pop("y"), rel_tol=1e-9)
+        feature["value"].pop("name")
+        reference["value"].pop("name")
+        assert feature == reference
+
+
+@pytest.fixture(name="bundled")
+def fixture_bundled(raw_frame, tmp_path) -> ModelData:
+    save_table(str(tmp_path / "model_data"), raw_frame)
+    return ModelData(str(tmp_path / "model_data"))
+
+
+@pytest.mark.parametrize("source", ["model_data", "bundled"])
+def test_features_match_the_baseline(source, raw_frame, request):
+    model_data = request.getfixturevalue(source)
+    expected = [baseline_feature(row, raw_frame) for _, row in raw_frame.iterrows()]
+    assert_same_features(df_to_interactive_spaces(model_data.df, model_data), expected)
+
+
+def test_fields_project_the_baseline(model_data, raw_frame):
+    expected = [baseline_feature(row, raw_frame) for _, row in raw_frame.iterrows()]
+    for fields in ("minimal", "word,tax_distribution,significant"):
+        keys = feature_keys(fields)
+        features = df_to_interactive_spaces(model_data.df, model_data, fields=keys)
+        assert [list(feature["value"]) for feature in features] == [keys] * len(features)
+        assert_same_features(
+            [{**feature, "value": {**feature["value"], "name": ""}} for feature in features],
+            [{**feature, "value": {**{key: feature["value"][key] for key in keys}, "name": ""}} for feature in expected],
+        )
+
+    assert feature_keys(None) == FIELD_PRESETS["full"]
+    with pytest.raises(ValueError):
+        feature_keys("word,unknown")
+
+
+def test_label_route_matches_the_baseline(client):
+    frame = make_frame()
+    selected = frame[(frame["predicted_class"] == "Defense") & ~frame["hypothetical"]]
+    response = client.get("/label/get/Defense").get_json()
+    assert_same_features(response["spaces"], [baseline_feature(row, frame) for _, row in selected.iterrows()])
+
+
+def test_prediction_summary_falls_back_to_the_pickle(tmp_path):
+    summary_df = pd.DataFrame({
+        "word": ["K00001.1", "K00002.1", "hypo_1"],
+        "prediction_summary": [{"Defense": 0.5, "CRISPR": 0.25}, {"Secretion": 0.75}, {"CRISPR": 0.125, "Defense": 0.125}],
+    })
+    summary_df.to_pickle(tmp_path / "prediction_summary.pkl")
+    build_predictions(argparse.Namespace(src=str(tmp_path / "prediction_summary.pkl"), out=str(tmp_path / "prediction_summary")))
+    packed = PredictionSummary(str(tmp_path / "prediction_summary"))
+    pickled = PredictionSummary(str(tmp_path / "missing"), str(tmp_path / "prediction_summary.pkl"))
+    for word in summary_df["word"]:
+        pd.testing.assert_frame_equal(pickled.to_pred_df(word), packed.to_pred_df(word))
+    assert pickled.to_pred_df("K00001.1")["class"].tolist() == ["Defense", "CRISPR"]
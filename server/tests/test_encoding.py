@@ -0,0 +1,47 @@
+import gzip
+import json
+
+import pytest
+from flask import Request, Response
+from werkzeug.test import EnvironBuilder
+
+from encoding import MIN_SIZE, compress_response
+
+BBOX = "/spaces/bbox?min_lat=-1000&min_lng=-1000&max_lat=1000&max_lng=1000"
+BODY = b"x" * MIN_SIZE
+
+
+def gzip_request() -> Request:
+    return Request(EnvironBuilder(headers={"Accept-Encoding": "gzip"}).get_environ())
+
+
+@pytest.mark.parametrize("path", [BBOX, "/label/get/Defense"])
+def test_responses_are_encoded_once(client, path):
+    identity = client.get(path, headers={"Accept-Encoding": "identity"})
+    encoded = client.get(path, headers={"Accept-Encoding": "gzip"})
+
+    assert encoded.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(encoded.data) == identity.data
+    json.loads(identity.data)
+
+
+def test_encoded_responses_are_left_alone():
+    response = compress_response(Response(BODY, headers={"Content-Encoding": "br"}), gzip_request())
+    assert response.headers["Content-Encoding"] == "br" and response.data == BODY
+
+
+@pytest.mark.parametrize("mimetype", ["image/png", "image/jpeg"])
+def test_images_are_not_compressed(mimetype):
+    response = compress_response(Response(BODY, mimetype=mimetype), gzip_request())
+    assert "Content-Encoding" not in response.headers and response.data == BODY
+
+
+def test_small_and_failed_responses_are_not_compressed():
+    for response in (Response(BODY[1:], mimetype="application/json"), Response(BODY, status=404)):
+        response = compress_response(response, gzip_request())
+        assert "Content-Encoding" not in response.headers and "Accept-Encoding" in response.vary
+
+
+def test_large_responses_are_compressed():
+    response = compress_response(Response(BODY, mimetype="application/json"), gzip_request())
+    assert response.headers["Content-Encoding"] == "gzip" and gzip.decompress(response.data) == BODY
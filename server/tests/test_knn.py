@@ -0,0 +1,36 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from build import build_knn
+from knn import KnnTable
+
+
+@pytest.fixture(name="knn_src")
+def fixture_knn_src(raw_frame, tmp_path):
+    """Neighbor files for some words of the frame, with ties, unknown words and an empty file."""
+    words = raw_frame["word"].tolist()
+    src = tmp_path / "knn_src"
+    src.mkdir()
+    for i, word in enumerate(words[:20]):
+        lines = [f"{words[(i + j * 7) % len(words)]} {round(0.9 - j * 0.05 * (i % 3), 3)}" for j in range(1, 1 + i % 6)]
+        if i % 4 == 0:
+            lines.append("unknown_word 0.95")
+        (src / f"{word}.txt").write_text("".join(f"{line}\n" for line in lines))
+
+    return src
+
+
+@pytest.mark.parametrize("k", [None, 0, 2, 10])
+def test_packed_table_matches_the_neighbor_files(model_data, raw_frame, knn_src, tmp_path, k):
+    build_knn(argparse.Namespace(src=str(knn_src), out=str(tmp_path / "knn"), k=None))
+    packed = KnnTable(model_data, str(tmp_path / "knn"))
+    files = KnnTable(model_data, str(tmp_path / "missing"), str(knn_src / "{word}.txt"))
+    for word in raw_frame["word"][:20]:
+        rows, distances = packed.lookup(word, k)
+        expected_rows, expected_distances = files.lookup(word, k)
+        assert rows.tolist() == expected_rows.tolist()
+        assert np.array_equal(distances, expected_distances)
+
+    assert len(packed.lookup("unknown_word", k)[0]) == 0
@@ -0,0 +1,139 @@
+import json
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_frame, pickled_model_data
+from plot import MANIFEST_NAME, Plotter, TileManifest, calc_zoom_levels, row_hashes, zoom_splitter
+from test_common import assert_same_features, baseline_feature
+
+COLUMNS = ["x", "y", "word", "tax_distribution"]
+
+
+def test_row_hashes_follow_tax_distribution_pairs(raw_frame, tmp_path):
+    before = pickled_model_data(raw_frame, tmp_path / "before.pkl")
+    changed = raw_frame.copy()
+    # Row 1 has one pair, row 2 two, row 3 three.
+    changed.at[1, "tax_distribution"] = [["Bacteria", changed.at[1, "tax_distribution"][0][1] + 1]]
+    changed.at[2, "tax_distribution"] = changed.at[2, "tax_distribution"][::-1]
+    changed.at[3, "tax_distribution"] = [["Viruses", 1], *changed.at[3, "tax_distribution"][1:]]
+    after = pickled_model_data(changed, tmp_path / "after.pkl")
+
+    hashes = row_hashes(before.df, COLUMNS, before)
+    again = row_hashes(pickled_model_data(raw_frame, tmp_path / "again.pkl").df, COLUMNS, before)
+    changed_hashes = row_hashes(after.df, COLUMNS, after)
+
+    assert (hashes == again).all()
+    assert list((hashes != changed_hashes).nonzero()[0]) == [1, 2, 3]
+
+
+@pytest.fixture(name="frame")
+def fixture_frame() -> pd.DataFrame:
+    """Larger than the default frame, with points on the tile boundaries of zooms 0 to 3, corners included."""
+    frame = make_frame(400, seed=1)
+    parts = zoom_splitter(3)[1:-1]
+    for i, part in enumerate(parts):
+        x_edge = Plotter.normalize_from_standard(part, frame["x"].min(), frame["x"].max())
+        y_edge = Plotter.normalize_from_standard(part, frame["y"].min(), frame["y"].max())
+        frame.loc[3 * i, "x"] = x_edge
+        frame.loc[3 * i + 1, "y"] = y_edge
+        frame.loc[3 * i + 2, ["x", "y"]] = [x_edge, Plotter.normalize_from_standard(parts[-1 - i], frame["y"].min(), frame["y"].max())]
+
+    return frame
+
+
+@pytest.fixture(name="plotter")
+def fixture_plotter(frame, tmp_path, monkeypatch) -> Plotter:
+    monkeypatch.chdir(tmp_path)
+    frame.to_pickle("model_data.pkl")
+    return Plotter(1)
+
+
+def original_plot_jsons(frame: pd.DataFrame, outdir: str, zoom: int, threshold: int) -> pd.DataFrame:
+    """`Plotter.plot_jsons` as it was before the points were binned, on the raw frame sorted like the `Plotter`."""
+    df = frame.assign(order=[["#808080", "#6a3d9a", "#ffc067", "#ff1493"].index(color) for color in frame["color"]])
+    df = df.sort_values(by=["order"], kind="stable")
+    zoom_levels = calc_zoom_levels(zoom)
+    for i, x_lines in enumerate(zoom_levels):
+        for j, zoom_ranges in enumerate(x_lines):
+            min_x = Plotter.normalize_from_standard(zoom_ranges[0][0], frame["x"].min(), frame["x"].max())
+            max_x = Plotter.normalize_from_standard(zoom_ranges[0][1], frame["x"].min(), frame["x"].max())
+            min_y = Plotter.normalize_from_standard(zoom_ranges[1][0], frame["y"].min(), frame["y"].max())
+            max_y = Plotter.normalize_from_standard(zoom_ranges[1][1], frame["y"].min(), frame["y"].max())
+            mask = (
+                (df["x"] >= min_x) &
+                (df["x"] <= max_x) &
+                (df["y"] >= min_y) &
+                (df["y"] <= max_y)
+            )
+
+            plot_df = df[mask]
+            if (threshold != -1 and len(plot_df) >= threshold) or len(plot_df) == 0:
+                continue
+
+            with open(os.path.join(outdir, f"space_by_label_{i}_{len(x_lines) - 1 - j}.json"), "w", encoding="utf8") as dest:
+                json.dump({"spaces": [baseline_feature(row, frame) for _, row in plot_df.iterrows()]}, dest)
+            df = df[~mask]
+
+    return df
+
+
+@pytest.mark.parametrize("threshold", [-1, 40])
+def test_plot_jsons_writes_the_original_tiles(plotter, frame, threshold, tmp_path):
+    written = 0
+    for zoom in range(4):
+        binned_dir, masks_dir = tmp_path / "binned" / str(zoom), tmp_path / "masks" / str(zoom)
+        os.makedirs(binned_dir)
+        os.makedirs(masks_dir)
+        remaining = plotter.plot_jsons(str(binned_dir), zoom, threshold)
+        expected_remaining = original_plot_jsons(frame, str(masks_dir), zoom, threshold)
+
+        names = sorted(os.listdir(masks_dir))
+        assert sorted(os.listdir(binned_dir)) == names
+        written += len(names)
+        for name in names:
+            with open(binned_dir / name, encoding="utf8") as binned, open(masks_dir / name, encoding="utf8") as masks:
+                assert_same_features(json.load(binned)["spaces"], json.load(masks)["spaces"])
+        assert remaining["word"].tolist() == expected_remaining["word"].tolist()
+
+    assert written
+
+
+def test_renderers_draw_the_same_png_tiles(plotter, tmp_path):
+    for zoom in range(2):
+        for renderer in ("matplotlib", "numpy"):
+            plotter.renderer = renderer
+            os.makedirs(tmp_path / renderer / str(zoom))
+            plotter.plot_static(plotter.model_data.df, str(tmp_path / renderer / str(zoom)), zoom)
+
+        names = sorted(os.listdir(tmp_path / "matplotlib" / str(zoom)))
+        assert len(names) == 4 ** zoom and sorted(os.listdir(tmp_path / "numpy" / str(zoom))) == names
+        for name in names:
+            images = [plt.imread(tmp_path / renderer / str(zoom) / name) for renderer in ("matplotlib", "numpy")]
+            assert drawn_diff(*images) * 255 <= 2.0
+
+
+def test_manifest_outside_outdir_skips_unchanged_tiles(plotter, tmp_path):
+    outdir, path = tmp_path / "map", str(tmp_path / "map_manifest.json")
+    for _ in range(2):
+        plotter.manifest = TileManifest(str(outdir), path=path)
+        for zoom in range(3):
+            os.makedirs(outdir / str(zoom), exist_ok=True)
+            plotter.plot_jsons(str(outdir / str(zoom)), zoom, 40)
+        plotter.manifest.finish(range(3))
+
+    assert not plotter.manifest.added and not plotter.manifest.changed and not plotter.manifest.removed
+    with open(path, encoding="utf8") as source:
+        assert len(json.load(source)["tiles"]) == len(plotter.manifest.tiles) > 0
+    assert not os.path.exists(outdir / MANIFEST_NAME)
+
+
+def drawn_diff(image: np.ndarray, other: np.ndarray) -> float:
+    """The mean premultiplied difference over the pixels either image draws, since the tiles are mostly empty and
+    fully transparent pixels may hold any color."""
+    image, other = image[..., :3] * image[..., 3:], other[..., :3] * other[..., 3:]
+    drawn = image.any(axis=-1) | other.any(axis=-1)
+    return float(np.abs(image - other)[drawn].mean())
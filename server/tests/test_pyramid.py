@@ -0,0 +1,78 @@
+import filecmp
+import os
+
+import pytest
+
+from pyramid import DICTIONARY_NAME, HEADER, KINDS, TileArchive, extract, list_tiles, pack, tile_key, tile_path
+
+TILES = [
+    (0, 0, 0, "png"),
+    (1, 0, 1, "json"),
+    (1, 1, 0, "bin"),
+    (1, 1, 0, "clusters.json"),
+    (1, 1, 0, "png"),
+    (9, 0, 511, "json"),
+    (9, 511, 0, "json"),
+    (9, 511, 511, "clusters.json"),
+]
+DICTIONARY = b'{"product": ["a", "b"], "widths": [1]}'
+
+
+@pytest.fixture(name="outdir")
+def fixture_outdir(tmp_path):
+    """A pyramid like plot.py writes, some tiles with the same content, the dictionary, and files that are not tiles."""
+    outdir = tmp_path / "map"
+    for i, tile in enumerate(TILES):
+        os.makedirs(outdir / str(tile[0]), exist_ok=True)
+        (outdir / tile_path(*tile)).write_bytes(b"same" if i % 3 == 0 else f"{tile}".encode("utf8") * (i + 1))
+    (outdir / DICTIONARY_NAME).write_bytes(DICTIONARY)
+    (outdir / "manifest.json").write_bytes(b"{}")
+    (outdir / "1" / "notes.txt").write_bytes(b"")
+    return outdir
+
+
+def test_archives_round_trip(outdir, tmp_path):
+    assert pack(str(outdir), str(tmp_path / "tiles.pyramid")) == len(TILES)
+    archive = TileArchive(str(tmp_path / "tiles.pyramid"))
+    assert archive.tiles() == sorted(TILES, key=lambda tile: tile_key(*tile)) == list_tiles(str(outdir))
+    for tile in TILES:
+        assert archive.get(*tile) == (outdir / tile_path(*tile)).read_bytes()
+    assert archive.get(0, 0, 0, "json") is None
+    assert archive.get(9, 511, 511, "png") is None
+    assert archive.dictionary() == DICTIONARY
+
+    assert extract(str(tmp_path / "tiles.pyramid"), str(tmp_path / "extracted")) == len(TILES)
+    paths = [tile_path(*tile) for tile in TILES] + [DICTIONARY_NAME]
+    assert sorted(os.path.relpath(os.path.join(root, name), tmp_path / "extracted")
+                  for root, _, names in os.walk(tmp_path / "extracted") for name in names) == sorted(paths)
+    _, mismatch, errors = filecmp.cmpfiles(outdir, tmp_path / "extracted", paths, shallow=False)
+    assert not mismatch and not errors
+
+
+def test_archives_store_equal_tiles_once(outdir, tmp_path):
+    pack(str(outdir), str(tmp_path / "tiles.pyramid"))
+    contents = {(outdir / tile_path(*tile)).read_bytes() for tile in TILES}
+    # The header, each content once, the dictionary, then keys, offsets and lengths.
+    size = HEADER.size + sum(map(len, contents)) + len(DICTIONARY) + 3 * 8 * len(TILES)
+    assert (tmp_path / "tiles.pyramid").stat().st_size == size
+
+
+def test_tile_keys_order_and_decode(tmp_path):
+    tiles = [(zoom, x, y, kind) for zoom in (0, 5, 9) for x in (0, 2 ** zoom - 1) for y in (0, 2 ** zoom - 1) for kind in KINDS]
+    for tile in tiles:
+        os.makedirs(tmp_path / "map" / str(tile[0]), exist_ok=True)
+        (tmp_path / "map" / tile_path(*tile)).write_bytes(b"")
+    pack(str(tmp_path / "map"), str(tmp_path / "tiles.pyramid"))
+    assert TileArchive(str(tmp_path / "tiles.pyramid")).dictionary() is None
+    extract(str(tmp_path / "tiles.pyramid"), str(tmp_path / "extracted"))
+    assert not (tmp_path / "extracted" / DICTIONARY_NAME).exists()
+
+    # By zoom, then column, then row, then kind.
+    assert TileArchive(str(tmp_path / "tiles.pyramid")).tiles() == sorted(set(tiles), key=lambda tile: (*tile[:3], KINDS.index(tile[3])))
+
+
+def test_a_missing_archive_holds_no_tiles(tmp_path):
+    archive = TileArchive(str(tmp_path / "missing.pyramid"))
+    assert len(archive) == 0
+    assert archive.get(0, 0, 0, "png") is None
+    assert archive.dictionary() is None
@@ -0,0 +1,29 @@
+import re
+
+import pandas as pd
+import pytest
+
+from search import SearchIndex
+
+VALUES = pd.Series(
+    [f"K{i:05d}.{i % 7}" for i in range(300)] + [f"hypo_{i}" for i in range(100)]
+    + ["a.b", "A+B (x)", "ab", "abbbc", "[bracket]", "x{2}y", "tab\there", "Ünïcode", "K00001.1", None]
+)
+
+
+@pytest.mark.parametrize("filter_", [
+    "K00001.1", "k00001.1", "K0001.", "K00010.3,hypo_3", "00[12]", "0[12]", "^K0001", "\\.6$", "hypo_1.",
+    "K0+1\\.1", "K0{2}1.1", "K00?1.1", "K00*12", "hypo_(1|2)3", "(hypo|K001)", "a\\.b", "a.b|ab", "ab+c", "ab*c",
+    "\\d\\d\\d\\.2", "\\x4b00001", "\\[brack", "[\\[]bracket", "x\\{2", "\\bhypo_9\\b", "tab\\there", "ünï.ode", "|K",
+    "hypo_[^1]0", "K000[]1]1", "a|b|", ".*",
+])
+def test_regex_filters_match_a_full_scan(filter_):
+    index = SearchIndex(VALUES)
+    pattern = re.compile(filter_.replace(",", "|"), flags=re.IGNORECASE)
+    assert list(index.matches(filter_)) == [value for value in index.values if pattern.search(value)]
+
+
+def test_dotted_words_are_not_scanned():
+    index = SearchIndex(VALUES)
+    for pattern in ("K00001.1", "K00001.1|hypo_4"):
+        assert len(list(index._regex_candidates(pattern))) < len(index) // 10  # pylint: disable=protected-access
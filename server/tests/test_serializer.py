@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import serializer
+
+VALUES = {
+    "nan": float("nan"),
+    "numpy": [np.float32(np.nan), np.int64(3), np.bool_(True), np.array([0.5, np.nan, np.inf])],
+    "missing": pd.NA,
+    "pair": ("Bacteria", 3),
+    "nested": {"z": 1, "y": [None, -float("inf")]},
+}
+EXPECTED = b'{"missing":null,"nan":null,"nested":{"y":[null,null],"z":1},"numpy":[null,3,true,[0.5,null,null]],"pair":["Bacteria",3]}'
+
+
+@pytest.mark.parametrize("engine", ["orjson", "json"])
+def test_dumps(engine, monkeypatch):
+    if engine == "json":
+        monkeypatch.setattr(serializer, "orjson", None)
+    elif serializer.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    assert serializer.dumps(VALUES, sort_keys=True) == EXPECTED
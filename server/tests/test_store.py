@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from store import Ragged, Table, load_ragged, save_ragged, save_table
+
+
+def test_ragged_keeps_pair_types(tmp_path):
+    lists = [[["Bacteria", 3], ["Archaea", 1]], np.nan, [], [["Viruses", 12]]]
+    ragged = Ragged.from_lists(lists)
+    save_ragged(str(tmp_path), "pairs", ragged)
+    loaded = load_ragged(str(tmp_path), "pairs")
+
+    expected = [[["Bacteria", 3], ["Archaea", 1]], None, [], [["Viruses", 12]]]
+    for packed in (ragged, loaded):
+        taken = packed.take(packed.ids)
+        assert taken == expected
+        assert all(isinstance(count, int) for pairs in taken if pairs for _, count in pairs)
+
+
+def test_ragged_scalars(tmp_path):
+    for lists in ([["a", "b"], None, ["c"]], [[0.5, 0.25], None, [1.0]]):
+        save_ragged(str(tmp_path), "scalars", Ragged.from_lists(lists))
+        assert load_ragged(str(tmp_path), "scalars").take(np.array([0, -1, 2])) == [lists[0], None, lists[2]]
+
+
+def test_table_round_trip(tmp_path, raw_frame):
+    save_table(str(tmp_path), raw_frame)
+    table = Table(str(tmp_path))
+
+    assert table.columns == list(raw_frame.columns)
+    lists = raw_frame["tax_distribution"].tolist()
+    assert table.ragged("tax_distribution").take(table.column("tax_distribution").to_numpy()) == [
+        value if isinstance(value, list) else None for value in lists
+    ]
+    for name in ("word", "KO", "ncbi_nr", "predicted_class", "significant", "word_count"):
+        pd.testing.assert_series_equal(
+            table.column(name).astype(object).where(table.column(name).notna(), None),
+            raw_frame[name].astype(object).where(raw_frame[name].notna(), None),
+            check_names=False,
+        )
@@ -0,0 +1,23 @@
+import os
+
+from conftest import make_frame
+from plot import Plotter
+from vectortile import decode_tile
+
+
+def test_ids_are_model_data_positions(tmp_path, monkeypatch):
+    # Index labels that are neither positions nor integers, as a pickle may have.
+    frame = make_frame()
+    frame.index = [f"row {i}" for i in reversed(range(len(frame)))]
+    frame.to_pickle(tmp_path / "model_data.pkl")
+    monkeypatch.chdir(tmp_path)
+
+    plotter = Plotter(1, tile_format="binary")
+    os.makedirs("0")
+    plotter.plot_jsons("0", 0, -1)
+    with open(os.path.join("0", "space_by_label_0_0.bin"), "rb") as source:
+        features = decode_tile(source.read(), plotter.dictionary.to_json())
+
+    assert features
+    assert [feature["id"] for feature in features] != frame["word"].tolist()
+    assert [frame["word"].iloc[feature["value"]["row"]] for feature in features] == [feature["id"] for feature in features]
@@ -0,0 +1,160 @@
+"""A compact binary alternative to the json point tiles of `plot.py`.
+
+A tile is a header followed by one column per attribute, each padded to 4 bytes so clients can view them as typed
+arrays without copying. All numbers are little endian:
+
+    magic "GNVT", version uint16, padding uint16, point count uint32,
+    tile bounds in map coordinates (see `df_coord_to_latlng`): west, south, east, north float64,
+    ids uint32: the positions of the points in the model data, to fetch the heavy attributes (`HEAVY_COLUMNS`) from `/features?ids=`,
+    x, y uint16: positions in the tile bounds, 0 to `EXTENT`,
+    flags uint8: `FLAGS` bits,
+    word_count int32, -1 when missing,
+    tax_ratio float32, -1 when missing,
+    one code column per `DICTIONARY_COLUMNS` entry: uint8, uint16 or uint32 as the dictionary's `widths` say, indices
+    into the dictionary's values for that column with all bits set when missing,
+    words: uint32 offsets, one more than points, into the utf8 bytes that follow.
+
+The dictionary is shared by the whole pyramid (`dictionary.json` next to the zoom directories, `/tiles/dictionary.json`
+from the server).
+"""
+import struct
+
+import numpy as np
+import pandas as pd
+
+from common import ModelData, df_coord_to_latlng
+
+MAGIC = b"GNVT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI4d")
+EXTENT = 2 ** 16 - 1
+# Feature key -> model data column, for the string attributes encoded as codes into the shared dictionary.
+DICTIONARY_COLUMNS = {
+    "ko": "KO",
+    "product": "product",
+    "gene_name": "gene_name",
+    "predicted_class": "predicted_class",
+    "color": "color",
+}
+# Feature key -> bit, for a boolean attribute and for it missing.
+FLAGS = {
+    "significant": (1, 2),
+    "hypothetical": (4, 8),
+}
+# Left out of the tiles, fetched by id.
+HEAVY_COLUMNS = ["ncbi_nr", "tax_distribution"]
+
+
+class TileDictionary:
+    """The sorted distinct values of the `DICTIONARY_COLUMNS` of the model data."""
+    def __init__(self, model_data: ModelData):
+        self.values = {
+            key: sorted(model_data.column(column).astype(object).dropna().unique().tolist())
+            for key, column in DICTIONARY_COLUMNS.items()
+        }
+        self._indexes = {key: pd.Index(values, dtype=object) for key, values in self.values.items()}
+
+    def codes(self, key: str, values: pd.Series) -> np.ndarray:
+        """Returns the codes of `values` in the dictionary of `key`, all bits set for missing values."""
+        width = dictionary_width(len(self.values[key]))
+        codes = self._indexes[key].get_indexer(values.astype(object))
+        return np.where(codes >= 0, codes, np.iinfo(width).max).astype(width)
+
+    def to_json(self) -> dict:
+        return {
+            "version": VERSION,
+            "extent": EXTENT,
+            "columns": self.values,
+            "widths": {key: np.dtype(dictionary_width(len(values))).itemsize for key, values in self.values.items()},
+        }
+
+
+def dictionary_width(size: int) -> type:
+    """The narrowest code type for a dictionary of `size` values, keeping the largest code for missing values."""
+    for width in (np.uint8, np.uint16):
+        if size < np.iinfo(width).max:
+            return width
+
+    return np.uint32
+
+
+def encode_tile(spaces: pd.DataFrame, rows: np.ndarray, model_data: ModelData, dictionary: TileDictionary, bounds: tuple) -> bytes:
+    """Encodes the points of a tile, with `rows` their positions in the model data and `bounds` the tile's min x,
+    max x, min y and max y in model coordinates."""
+    min_x, max_x, min_y, max_y = bounds
+    (south, north), (west, east) = df_coord_to_latlng(np.array([min_y, max_y]), np.array([min_x, max_x]), model_data)
+    lat, lng = df_coord_to_latlng(spaces["y"].to_numpy(dtype=float), spaces["x"].to_numpy(dtype=float), model_data)
+    flags = np.zeros(len(spaces), dtype=np.uint8)
+    for key, (bit, missing_bit) in FLAGS.items():
+        values = spaces[key]
+        flags |= np.where(values.to_numpy(dtype=bool, na_value=False), bit, 0).astype(np.uint8)
+        flags |= np.where(values.isna().to_numpy(), missing_bit, 0).astype(np.uint8)
+
+    words = [word.encode("utf8") for word in spaces["word"].tolist()]
+    offsets = np.zeros(len(words) + 1, dtype=np.uint32)
+    np.cumsum([len(word) for word in words], out=offsets[1:])
+    columns = [
+        rows.astype(np.uint32),
+        _quantize(lng, west, east),
+        _quantize(lat, south, north),
+        flags,
+        spaces["word_count"].to_numpy(dtype=float, na_value=-1).astype(np.int32),
+        spaces["tax_ratio"].to_numpy(dtype=float, na_value=-1).astype(np.float32),
+        *(dictionary.codes(key, spaces[column]) for key, column in DICTIONARY_COLUMNS.items()),
+        offsets,
+        np.frombuffer(b"".join(words), dtype=np.uint8),
+    ]
+    header = HEADER.pack(MAGIC, VERSION, 0, len(spaces), west, south, east, north)
+    return header + b"".join(_padded(column.astype(column.dtype.newbyteorder("<")).tobytes()) for column in columns)
+
+
+def decode_tile(data: bytes, dictionary: dict) -> list[dict]:
+    """Decodes a tile into features like the json tiles', with the row id instead of the heavy attributes."""
+    magic, version, _, count, west, south, east, north = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} tile")
+
+    position = HEADER.size
+
+    def column(dtype, length=count) -> np.ndarray:
+        nonlocal position
+        values = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"), count=length, offset=position)
+        position += len(_padded(values.tobytes()))
+        return values
+
+    rows = column(np.uint32)
+    lng = west + column(np.uint16) / EXTENT * (east - west)
+    lat = south + column(np.uint16) / EXTENT * (north - south)
+    flags = column(np.uint8)
+    word_count = column(np.int32)
+    tax_ratio = column(np.float32)
+    codes = {}
+    for key in DICTIONARY_COLUMNS:
+        width = {1: np.uint8, 2: np.uint16, 4: np.uint32}[dictionary["widths"][key]]
+        codes[key] = column(width)
+
+    offsets = column(np.uint32, count + 1)
+    words = column(np.uint8, int(offsets[-1])).tobytes()
+
+    features = []
+    for i in range(count):
+        word = words[offsets[i]:offsets[i + 1]].decode("utf8")
+        value = {"word": word, "row": int(rows[i]), "word_count": int(word_count[i]), "tax_ratio": float(tax_ratio[i])}
+        for key, (bit, missing_bit) in FLAGS.items():
+            value[key] = None if flags[i] & missing_bit else bool(flags[i] & bit)
+        for key, key_codes in codes.items():
+            code = int(key_codes[i])
+            value[key] = dictionary["columns"][key][code] if code < len(dictionary["columns"][key]) else None
+
+        features.append({"id": word, "x": float(lng[i]), "y": float(lat[i]), "value": value})
+
+    return features
+
+
+def _quantize(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    scaled = (values - low) / (high - low) * EXTENT if high > low else np.zeros(len(values))
+    return np.clip(np.round(scaled), 0, EXTENT).astype(np.uint16)
+
+
+def _padded(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)